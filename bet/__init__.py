@@ -26,10 +26,16 @@ postProcess :mod:`~bet.postProcess` provides plotting tools and tools to sort
 sample :mod:`~bet.sample` provides data structures to store sets of samples and
     their associated arrays.
 
+spatialIndex :mod:`~bet.spatialIndex` provides spatial indices used to locate
+    points within the cells of a sample set.
+
+storage :mod:`~bet.storage` provides the chunked file format used to save
+    sample sets and discretizations.
+
 surrogates :mod:`~bet.surrogates` provides methods for generating and using
     surrogate models.
 
 """
 
 __all__ = ['sampling', 'calculateP', 'postProcess', 'sensitivity', 'util',
-           'Comm', 'sample', 'surrogates']
+           'Comm', 'sample', 'spatialIndex', 'storage', 'surrogates']
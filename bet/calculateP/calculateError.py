@@ -399,8 +399,9 @@ class model_error(object):
         # Setup new discretization object adding error estimates
         #: :class:`bet.sample.discretiztion` from adding error estimates
         self.disc_new = disc.copy()
-        self.disc_new._output_sample_set._values_local += self.disc.\
-            _output_sample_set._error_estimates_local
+        self.disc_new._output_sample_set.set_values_local(
+            self.disc_new._output_sample_set._values_local +
+            self.disc._output_sample_set._error_estimates_local)
         self.disc_new.set_io_ptr(globalize=False)
         self.disc_new._io_ptr = None
 
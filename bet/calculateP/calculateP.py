@@ -22,6 +22,41 @@ import bet.util as util
 import bet.sample as samp
 
 
+def _distribute(P, ptr, probabilities, cell_sums, weights=None):
+    r"""
+    Divides the probability of each cell with a positive probability and a
+    positive sum over the entries of ``ptr`` pointing to it, either
+    uniformly or proportionally to ``weights``.
+
+    :param P: probabilities of the entries of ``ptr`` to update
+    :type P: :class:`~numpy.ndarray` of shape (N,)
+    :param ptr: cell pointers
+    :type ptr: :class:`~numpy.ndarray` of shape (N,)
+    :param probabilities: probabilities of the cells
+    :type probabilities: :class:`~numpy.ndarray` of shape (num,)
+    :param cell_sums: number of entries or sum of ``weights`` in each cell
+    :type cell_sums: :class:`~numpy.ndarray` of shape (num,)
+    :param weights: weights of the entries of ``ptr``
+    :type weights: :class:`~numpy.ndarray` of shape (N,)
+    :rtype: :class:`~numpy.ndarray` of shape (N,)
+    :returns: P
+
+    """
+    ptr = np.ravel(ptr)
+    num = len(cell_sums)
+    inside = np.less(ptr, num)
+    Itemp = np.zeros(ptr.shape, dtype=bool)
+    Itemp[inside] = np.logical_and(
+        np.greater(probabilities[ptr[inside]], 0.0),
+        np.greater(cell_sums[ptr[inside]], 0))
+    cell = ptr[Itemp]
+    if weights is None:
+        P[Itemp] = probabilities[cell] / cell_sums[cell]
+    else:
+        P[Itemp] = probabilities[cell] * weights[Itemp] / cell_sums[cell]
+    return P
+
+
 def prob_on_emulated_samples(discretization, globalize=True):
     r"""
 
@@ -47,23 +82,33 @@ def prob_on_emulated_samples(discretization, globalize=True):
     if discretization._emulated_ii_ptr_local is None:
         discretization.set_emulated_ii_ptr(globalize=False)
 
-    # Calculate Probabilties
-    P = np.zeros((discretization._emulated_input_sample_set.
-                  _values_local.shape[0],))
-    d_distr_emu_ptr = discretization._io_ptr[discretization.
-                                             _emulated_ii_ptr_local]
-    for i in range(op_num):
-        if discretization._output_probability_set._probabilities[i] > 0.0:
-            Itemp = np.equal(d_distr_emu_ptr, i)
-            Itemp_sum = np.sum(Itemp)
-            Itemp_sum = comm.allreduce(Itemp_sum, op=MPI.SUM)
-            if Itemp_sum > 0:
-                P[Itemp] = discretization._output_probability_set.\
-                    _probabilities[i] / Itemp_sum
+    # Calculate Probabilties, streaming through the emulated samples
+    emulated_set = discretization._emulated_input_sample_set
+    emulated_ii_ptr = discretization._emulated_ii_ptr_local
+    num_emulate = emulated_ii_ptr.shape[0]
+    chunk_size = emulated_set.get_chunk_size()
+    if chunk_size is None:
+        chunk_size = max(num_emulate, 1)
+    chunks = [slice(start, start + chunk_size) for start in
+              range(0, num_emulate, chunk_size)]
+    Itemp_sum = np.zeros((op_num,), dtype=np.int64)
+    for chunk in chunks:
+        (chunk_sum, _) = util.cell_sums(
+            discretization._io_ptr[emulated_ii_ptr[chunk]], op_num,
+            globalize=False)
+        Itemp_sum += chunk_sum
+    Itemp_sum = comm.allreduce(Itemp_sum, op=MPI.SUM)
+    P = emulated_set.empty_array('_probabilities_local', (num_emulate,))
+    for chunk in chunks:
+        P[chunk] = _distribute(np.zeros((P[chunk].shape[0],)),
+                               discretization._io_ptr[emulated_ii_ptr[chunk]],
+                               discretization._output_probability_set.
+                               _probabilities, Itemp_sum)
 
     discretization._emulated_input_sample_set._probabilities_local = P
     if globalize:
-        discretization._emulated_input_sample_set.local_to_global()
+        discretization._emulated_input_sample_set.local_to_global(
+            ['_probabilities'])
     pass
 
 
@@ -92,16 +137,12 @@ def prob(discretization, globalize=True):
     if discretization._input_sample_set._values_local is None:
         discretization._input_sample_set.global_to_local()
     P_local = np.zeros((len(discretization._io_ptr_local),))
-    for i in range(op_num):
-        if discretization._output_probability_set._probabilities[i] > 0.0:
-            Itemp = np.equal(discretization._io_ptr_local, i)
-            Itemp_sum = np.sum(discretization._input_sample_set.
-                               _volumes_local[Itemp])
-            Itemp_sum = comm.allreduce(Itemp_sum, op=MPI.SUM)
-            if Itemp_sum > 0:
-                P_local[Itemp] = discretization._output_probability_set.\
-                    _probabilities[i] * discretization._input_sample_set.\
-                    _volumes_local[Itemp] / Itemp_sum
+    vol_local = discretization._input_sample_set._volumes_local
+    (_, [Itemp_sum]) = util.cell_sums(discretization._io_ptr_local, op_num,
+                                      [vol_local])
+    P_local = _distribute(P_local, discretization._io_ptr_local,
+                          discretization._output_probability_set.
+                          _probabilities, Itemp_sum, vol_local)
     if globalize:
         discretization._input_sample_set._probabilities = util.\
             get_global_values(P_local)
@@ -166,8 +207,10 @@ def prob_from_sample_set_with_emulated_volumes(set_old, set_new,
         set_emulate.global_to_local()
 
     # Map emulated points to old and new sets
-    (_, ptr1) = set_old.query(set_emulate._values_local)
-    (_, ptr2) = set_new.query(set_emulate._values_local)
+    ptr1 = set_old.query_chunked(set_emulate._values_local,
+                                 chunk_size=set_emulate.get_chunk_size())
+    ptr2 = set_new.query_chunked(set_emulate._values_local,
+                                 chunk_size=set_emulate.get_chunk_size())
     ptr1 = ptr1.flat[:]
     ptr2 = ptr2.flat[:]
 
@@ -175,17 +218,11 @@ def prob_from_sample_set_with_emulated_volumes(set_old, set_new,
     prob_new = np.zeros((num_new,))
     prob_em = np.zeros((len(ptr1), ))
 
-    # Loop over old cells and divide probability over emulated cells
-    warn = False
-    for i in range(num_old):
-        if set_old._probabilities[i] > 0.0:
-            Itemp = np.equal(ptr1, i)
-            Itemp_sum = np.sum(Itemp)
-            Itemp_sum = comm.allreduce(Itemp_sum, op=MPI.SUM)
-            if Itemp_sum > 0:
-                prob_em[Itemp] += set_old._probabilities[i] / float(Itemp_sum)
-            else:
-                warn = True
+    # Divide probability of old cells over emulated cells
+    (Itemp_sum, _) = util.cell_sums(ptr1, num_old)
+    prob_em = _distribute(prob_em, ptr1, set_old._probabilities, Itemp_sum)
+    warn = np.any(np.logical_and(np.greater(set_old._probabilities, 0.0),
+                                 np.equal(Itemp_sum, 0)))
     # Warn that some cells have no emulated points in them
     if warn:
         msg = "Some old cells have no emulated points in them. "
@@ -194,12 +231,8 @@ def prob_from_sample_set_with_emulated_volumes(set_old, set_new,
         total_prob = np.sum(prob_em)
         total_prob = comm.allreduce(total_prob, op=MPI.SUM)
         prob_em = prob_em / total_prob
-    # Loop over new cells and distribute probability from emulated cells
-    for i in range(num_new):
-        Itemp = np.equal(ptr2, i)
-        Itemp_sum = np.sum(prob_em[Itemp])
-        Itemp_sum = comm.allreduce(Itemp_sum, op=MPI.SUM)
-        prob_new[i] = Itemp_sum
+    # Distribute probability from emulated cells over new cells
+    (_, [prob_new]) = util.cell_sums(ptr2, num_new, [prob_em])
 
     # Set probabilities
     set_new.set_probabilities(prob_new)
@@ -230,18 +263,16 @@ def prob_from_sample_set(set_old, set_new):
     # Map old points new sets
     if set_old._values_local is None:
         set_old.global_to_local()
-    (_, ptr) = set_new.query(set_old._values_local)
+    ptr = set_new.query_chunked(set_old._values_local,
+                                chunk_size=set_old.get_chunk_size())
     ptr = ptr.flat[:]
 
     # Set up probability vector
     prob_new = np.zeros((num_new,))
 
-    # Loop over new cells and distribute probability from old
-    for i in range(num_new):
-        Itemp = np.equal(ptr, i)
-        Itemp_sum = np.sum(set_old._probabilities_local[Itemp])
-        Itemp_sum = comm.allreduce(Itemp_sum, op=MPI.SUM)
-        prob_new[i] = Itemp_sum
+    # Distribute probability from old cells over new cells
+    (_, [prob_new]) = util.cell_sums(ptr, num_new,
+                                     [set_old._probabilities_local])
 
     # Set probabilities
     set_new.set_probabilities(prob_new)
@@ -280,18 +311,15 @@ def prob_from_discretization_input(disc, set_new):
     if (disc._input_sample_set._dim != set_new._dim):
         raise samp.dim_not_matching("Dimensions of sets are not equal.")
 
-    (_, ptr) = set_new.query(em_set._values_local)
+    ptr = set_new.query_chunked(em_set._values_local,
+                                chunk_size=em_set.get_chunk_size())
     ptr = ptr.flat[:]
 
     # Set up probability vectors
     prob_new = np.zeros((num_new,))
     prob_em = em_set._probabilities_local
 
-    for i in range(num_new):
-        Itemp = np.equal(ptr, i)
-        Itemp_sum = np.sum(prob_em[Itemp])
-        Itemp_sum = comm.allreduce(Itemp_sum, op=MPI.SUM)
-        prob_new[i] = Itemp_sum
+    (_, [prob_new]) = util.cell_sums(ptr, num_new, [prob_em])
 
     # Set probabilities
     set_new.set_probabilities(prob_new)
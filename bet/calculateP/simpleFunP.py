@@ -229,15 +229,9 @@ def uniform_partition_uniform_distribution_rectangle_size(data_set,
     # Bin these samples using nearest neighbor searches
     (_, k) = s_set.query(d_distr_emulate)
 
-    count_neighbors = np.zeros((M,), dtype=np.int)
-    for i in range(M):
-        count_neighbors[i] = np.sum(np.equal(k, i))
+    (count_neighbors, _) = util.cell_sums(k, M)
 
     # Use the binning to define :math:`\rho_{\mathcal{D},M}`
-    ccount_neighbors = np.copy(count_neighbors)
-    comm.Allreduce([count_neighbors, MPI.INT], [ccount_neighbors, MPI.INT],
-                   op=MPI.SUM)
-    count_neighbors = ccount_neighbors
     rho_D_M = count_neighbors.astype(np.float64) / float(num_d_emulate)
     s_set.set_probabilities(rho_D_M)
 
@@ -357,7 +351,8 @@ def uniform_partition_uniform_distribution_rectangle_domain(data_set,
 
 def regular_partition_uniform_distribution_rectangle_size(data_set, Q_ref=None,
                                                           rect_size=None,
-                                                          cells_per_dimension=1):
+                                                          cells_per_dimension=1,
+                                                          implicit=False):
     r"""
     Creates a simple function approximation of :math:`\rho_{\mathcal{D},M}`
     where :math:`\rho_{\mathcal{D},M}` is a uniform probability density
@@ -377,6 +372,8 @@ def regular_partition_uniform_distribution_rectangle_size(data_set, Q_ref=None,
     :param Q_ref: :math:`Q(\lambda_{reference})`
     :type Q_ref: :class:`~numpy.ndarray` of size (mdim,)
     :param list cells_per_dimension: number of cells per dimension.
+    :param bool implicit: Only store the coordinates of the grid, see
+        :meth:`bet.sample.cartesian_sample_set.setup`
 
     :rtype: :class:`~bet.sample.rectangle_sample_set`
     :returns: sample_set object defining simple function approximation
@@ -408,7 +405,7 @@ def regular_partition_uniform_distribution_rectangle_size(data_set, Q_ref=None,
                               cells_per_dimension[i] + 1))
 
     s_set = samp.cartesian_sample_set(dim)
-    s_set.setup(xi)
+    s_set.setup(xi, implicit)
     domain = np.zeros((dim, 2))
     domain[:, 0] = mins[0]
     domain[:, 1] = maxes[0]
@@ -427,7 +424,8 @@ def regular_partition_uniform_distribution_rectangle_size(data_set, Q_ref=None,
 
 def regular_partition_uniform_distribution_rectangle_domain(data_set,
                                                             rect_domain,
-                                                            cells_per_dimension=1):
+                                                            cells_per_dimension=1,
+                                                            implicit=False):
     r"""
     Creates a simple function appoximation of :math:`\rho_{\mathcal{D},M}`
     where :math:`\rho{\mathcal{D}, M}` is a uniform probablity density over the
@@ -443,6 +441,8 @@ def regular_partition_uniform_distribution_rectangle_domain(data_set,
         uniform.
     :type rect_domain: :class:`numpy.ndarray` of shape (2, mdim)
     :param list cells_per_dimension: number of cells per dimension
+    :param bool implicit: Only store the coordinates of the grid, see
+        :meth:`bet.sample.cartesian_sample_set.setup`
 
 
     :rtype: :class:`~bet.sample.rectangle_sample_set`
@@ -461,13 +461,15 @@ def regular_partition_uniform_distribution_rectangle_domain(data_set,
     return regular_partition_uniform_distribution_rectangle_size(data_set,
                                                                  domain_center,
                                                                  domain_lengths,
-                                                                 cells_per_dimension)
+                                                                 cells_per_dimension,
+                                                                 implicit)
 
 
 def regular_partition_uniform_distribution_rectangle_scaled(data_set,
                                                             Q_ref=None,
                                                             rect_scale=1,
-                                                            cells_per_dimension=1):
+                                                            cells_per_dimension=1,
+                                                            implicit=False):
     r"""
     Creates a simple function approximation of :math:`\rho_{\mathcal{D},M}`
     where :math:`\rho_{\mathcal{D},M}` is a uniform probability density
@@ -489,6 +491,8 @@ def regular_partition_uniform_distribution_rectangle_scaled(data_set,
     :param Q_ref: :math:`Q(\lambda_{reference})`
     :type Q_ref: :class:`~numpy.ndarray` of size (mdim,)
     :param list cells_per_dimension: number of cells per dimension
+    :param bool implicit: Only store the coordinates of the grid, see
+        :meth:`bet.sample.cartesian_sample_set.setup`
 
     :rtype: :class:`~bet.sample.rectangle_sample_set`
     :returns: sample_set object defining simple function approximation
@@ -507,7 +511,8 @@ def regular_partition_uniform_distribution_rectangle_scaled(data_set,
     return regular_partition_uniform_distribution_rectangle_size(data_set,
                                                                  Q_ref,
                                                                  rect_size,
-                                                                 cells_per_dimension)
+                                                                 cells_per_dimension,
+                                                                 implicit)
 
 
 def uniform_partition_uniform_distribution_data_samples(data_set):
@@ -623,22 +628,11 @@ def normal_partition_normal_distribution(data_set, Q_ref=None, std=1, M=1,
         d_distr_samples = np.expand_dims(d_distr_samples, axis=1)
 
     (_, k) = s_set.query(d_distr_emulate)
-    count_neighbors = np.zeros((M,), dtype=np.int)
-    volumes = np.zeros((M,))
-    for i in range(M):
-        Itemp = np.equal(k, i)
-        count_neighbors[i] = np.sum(Itemp)
-        volumes[i] = np.sum(1.0 / stats.multivariate_normal.pdf
-                            (d_distr_emulate[Itemp, :], Q_ref, covariance))
+    inv_pdf = 1.0 / stats.multivariate_normal.pdf(d_distr_emulate, Q_ref,
+                                                  covariance)
+    (count_neighbors, [volumes]) = util.cell_sums(k, M, [inv_pdf])
     # Now define probability of the d_distr_samples
     # This together with d_distr_samples defines :math:`\rho_{\mathcal{D},M}`
-    ccount_neighbors = np.copy(count_neighbors)
-    comm.Allreduce([count_neighbors, MPI.INT], [ccount_neighbors, MPI.INT],
-                   op=MPI.SUM)
-    count_neighbors = ccount_neighbors
-    cvolumes = np.copy(volumes)
-    comm.Allreduce([volumes, MPI.DOUBLE], [cvolumes, MPI.DOUBLE], op=MPI.SUM)
-    volumes = cvolumes
     rho_D_M = count_neighbors.astype(np.float64) * volumes
     rho_D_M = rho_D_M / np.sum(rho_D_M)
     s_set.set_probabilities(rho_D_M)
@@ -715,18 +709,10 @@ def uniform_partition_normal_distribution(data_set, Q_ref=None, std=1, M=1,
         d_distr_samples = np.expand_dims(d_distr_samples, axis=1)
 
     (_, k) = s_set.query(d_distr_emulate)
-    count_neighbors = np.zeros((M,), dtype=np.int)
-    # volumes = np.zeros((M,))
-    for i in range(M):
-        Itemp = np.equal(k, i)
-        count_neighbors[i] = np.sum(Itemp)
+    (count_neighbors, _) = util.cell_sums(k, M)
 
     r'''Now define probability of the d_distr_samples This together with
     d_distr_samples defines :math:`\rho_{\mathcal{D},M}`'''
-    ccount_neighbors = np.copy(count_neighbors)
-    comm.Allreduce([count_neighbors, MPI.INT], [ccount_neighbors, MPI.INT],
-                   op=MPI.SUM)
-    count_neighbors = ccount_neighbors
     rho_D_M = count_neighbors.astype(np.float64) / float(num_d_emulate)
     s_set.set_probabilities(rho_D_M)
     # NOTE: The computation of q_distr_prob, q_distr_emulate, q_distr_samples
@@ -826,15 +812,9 @@ def user_partition_user_distribution(data_set, data_partition_set,
 
     (_, k) = s_set.query(d_distr_emulate)
 
-    count_neighbors = np.zeros((M,), dtype=np.int)
-    for i in range(M):
-        count_neighbors[i] = np.sum(np.equal(k, i))
+    (count_neighbors, _) = util.cell_sums(k, M)
 
     # Use the binning to define :math:`\rho_{\mathcal{D},M}`
-    ccount_neighbors = np.copy(count_neighbors)
-    comm.Allreduce([count_neighbors, MPI.INT], [ccount_neighbors, MPI.INT],
-                   op=MPI.SUM)
-    count_neighbors = ccount_neighbors
     rho_D_M = count_neighbors.astype(np.float64) / \
         float(num_d_emulate * comm.size)
     s_set.set_probabilities(rho_D_M)
@@ -287,8 +287,9 @@ class comparison(object):
         if self._comparison_sample_set._values_local is None:
             self._comparison_sample_set.global_to_local()
 
-        (_, self._ptr_left_local) = self._left_sample_set.query(
-            self._comparison_sample_set._values_local)
+        self._ptr_left_local = self._left_sample_set.query_chunked(
+            self._comparison_sample_set._values_local,
+            chunk_size=self._comparison_sample_set.get_chunk_size())
 
         if globalize:
             self._ptr_left = util.get_global_values(
@@ -327,8 +328,9 @@ class comparison(object):
         if self._comparison_sample_set._values_local is None:
             self._comparison_sample_set.global_to_local()
 
-        (_, self._ptr_right_local) = self._right_sample_set.query(
-            self._comparison_sample_set._values_local)
+        self._ptr_right_local = self._right_sample_set.query_chunked(
+            self._comparison_sample_set._values_local,
+            chunk_size=self._comparison_sample_set.get_chunk_size())
 
         if globalize:
             self._ptr_right = util.get_global_values(
@@ -0,0 +1,1056 @@
+# Copyright (C) 2014-2019 The BET Development Team
+
+"""
+This module contains the spatial index structures used by
+:class:`bet.sample.sample_set_base` to locate points within a set of
+generating samples. Every index exposes the same ``query`` interface as
+:meth:`scipy.spatial.KDTree.query` and stores its generating samples as
+``data``. The available backends are:
+
+* ``'kdtree'`` wraps the pure Python :class:`scipy.spatial.KDTree`
+* ``'ckdtree'`` wraps the compiled :class:`scipy.spatial.cKDTree` and
+    supports multithreaded batch queries through ``workers``
+* ``'brute'`` computes all pairwise distances in blocks (BLAS accelerated for
+    the 2-norm), which is fastest for a small number of generating samples
+* ``'grid'`` hashes the generating samples into a regular grid of buckets,
+    which is fast for low dimensional spaces
+* ``'rpforest'`` searches the leaves of a forest of random projection trees,
+    which is approximate but fast for high dimensional spaces
+
+The backend used by default is set with :meth:`set_default_backend`.
+
+:class:`~bet.spatialIndex.incremental_index` keeps an index up to date as
+samples are appended without rebuilding it every time.
+
+:class:`~bet.spatialIndex.box_index` locates points within a set of
+hyperrectangles and is used by :class:`bet.sample.rectangle_sample_set`.
+:class:`~bet.spatialIndex.cartesian_index` locates points within the cells of
+a Cartesian grid and is used by :class:`bet.sample.cartesian_sample_set`.
+:class:`~bet.spatialIndex.ball_index` locates points within a set of balls
+and is used by :class:`bet.sample.ball_sample_set`.
+"""
+
+import abc
+import copy
+import logging
+import numpy as np
+import scipy
+import scipy.spatial as spatial
+
+#: Name of the backend used when a sample set does not specify one
+default_backend = 'ckdtree'
+#: Number of threads used by backends that support multithreaded queries
+default_workers = 1
+#: Maximum number of pairwise distances held in memory at once
+max_block_size = int(2**22)
+#: Number of trees of a :class:`rp_forest_index`
+rp_forest_trees = 32
+#: Maximum number of generating samples in a leaf of a :class:`rp_forest_index`
+rp_forest_leaf_size = 128
+#: Seed of the random directions of a :class:`rp_forest_index`
+rp_forest_seed = 0
+
+# ``n_jobs`` was renamed to ``workers`` in :mod:`scipy` 1.6
+_scipy_version = tuple(int(v) for v in scipy.__version__.split('.')[:2])
+if _scipy_version >= (1, 6):
+    _workers_kwarg = 'workers'
+else:
+    _workers_kwarg = 'n_jobs'
+
+
+class unknown_backend(Exception):
+    """
+    Exception for when the requested spatial index backend does not exist.
+    """
+
+
+def minkowski_norm(x, p=2.0):
+    """
+    Calculates the Minkowski p-norm along the last axis of ``x``. The 1- and
+    infinity-norms are computed without powers or roots and the 2-norm
+    without temporary squares, other norms fall back to
+    :meth:`numpy.linalg.norm`.
+
+    :param x: array of vectors
+    :type x: :class:`numpy.ndarray` of shape ``(*, dim)``
+    :param float p: Which Minkowski p-norm to use. (1 <= p <= infinity)
+
+    :rtype: :class:`numpy.ndarray` of shape ``(*,)``
+    :returns: norms of the vectors in ``x``
+
+    """
+    if p == 2:
+        return np.sqrt(np.einsum('...i,...i->...', x, x))
+    if p == 1:
+        return np.sum(np.abs(x), axis=-1)
+    if np.isinf(p):
+        return np.max(np.abs(x), axis=-1, initial=0.0)
+    return np.linalg.norm(x, ord=p, axis=-1)
+
+
+def minkowski_within(x, radii, p=2.0):
+    """
+    Checks whether the Minkowski p-norms along the last axis of ``x``,
+    computed with :meth:`minkowski_norm`, are less than ``radii``. Points
+    on the boundary and balls with negative radii contain no points.
+
+    :param x: array of vectors
+    :type x: :class:`numpy.ndarray` of shape ``(*, dim)``
+    :param radii: radii to compare to
+    :type radii: :class:`numpy.ndarray` of shape ``(*,)``
+    :param float p: Which Minkowski p-norm to use. (1 <= p <= infinity)
+
+    :rtype: :class:`numpy.ndarray` of bool of shape ``(*,)``
+    :returns: whether the norms are less than ``radii``
+
+    """
+    return minkowski_norm(x, p) < radii
+
+
+def minkowski_distances(x, y, p=2.0):
+    """
+    Calculates the pairwise Minkowski p-norm distances between the rows of
+    ``x`` and ``y`` using the dedicated :meth:`scipy.spatial.distance.cdist`
+    metrics for the 1-, 2-, and infinity-norms.
+
+    :param x: points
+    :type x: :class:`numpy.ndarray` of shape ``(M, dim)``
+    :param y: points
+    :type y: :class:`numpy.ndarray` of shape ``(N, dim)``
+    :param float p: Which Minkowski p-norm to use. (1 <= p <= infinity)
+
+    :rtype: :class:`numpy.ndarray` of shape ``(M, N)``
+    :returns: distances
+
+    """
+    if p == 2:
+        return spatial.distance.cdist(x, y, 'euclidean')
+    if p == 1:
+        return spatial.distance.cdist(x, y, 'cityblock')
+    if np.isinf(p):
+        return spatial.distance.cdist(x, y, 'chebyshev')
+    return spatial.distance.cdist(x, y, 'minkowski', p=p)
+
+
+def _fill_missing(dist, ptr, num, distance_upper_bound):
+    """
+    Marks neighbors further than ``distance_upper_bound`` as missing using the
+    :meth:`scipy.spatial.KDTree.query` convention (``inf`` and ``num``).
+    """
+    missing = np.logical_not(dist <= distance_upper_bound)
+    dist[missing] = np.inf
+    ptr[missing] = num
+    return (dist, ptr)
+
+
+def _format_output(x, dist, ptr, k):
+    """
+    Reshapes the output of a query to match :meth:`scipy.spatial.KDTree.query`.
+    """
+    if k == 1:
+        dist = dist[:, 0]
+        ptr = ptr[:, 0]
+    if x.ndim == 1:
+        dist = dist[0]
+        ptr = ptr[0]
+    return (dist, ptr)
+
+
+def _k_smallest(dist, k):
+    """
+    Returns the sorted distances and column indices of the ``k`` smallest
+    entries of each row of ``dist``.
+    """
+    num = dist.shape[1]
+    if k < num:
+        ind = np.argpartition(dist, k - 1, axis=1)[:, :k]
+    else:
+        ind = np.tile(np.arange(num), (dist.shape[0], 1))
+    kdist = np.take_along_axis(dist, ind, axis=1)
+    order = np.argsort(kdist, axis=1, kind='mergesort')
+    return (np.take_along_axis(kdist, order, axis=1),
+            np.take_along_axis(ind, order, axis=1))
+
+
+def _first_k(point, cand, dist, ptr, k):
+    """
+    Stores the first ``k`` candidates of each point in ``ptr`` (with distance
+    0) where ``point`` is sorted and ``cand`` is sorted for each point.
+    """
+    rank = np.arange(point.shape[0]) - np.searchsorted(point, point, 'left')
+    keep = rank < k
+    ptr[point[keep], rank[keep]] = cand[keep]
+    dist[point[keep], rank[keep]] = 0.0
+
+
+class index_base(abc.ABC):
+    """
+    Abstract base class for spatial indices over a set of generating samples.
+    Subclasses must implement :meth:`query`.
+    """
+
+    def __init__(self, data, workers=None):
+        """
+        Initialization
+
+        :param data: generating samples
+        :type data: :class:`numpy.ndarray` of shape (num, dim)
+        :param int workers: number of threads to use for queries
+
+        """
+        #: Generating samples, :class:`numpy.ndarray` of shape (num, dim)
+        self.data = np.asarray(data)
+        #: Number of threads to use for queries
+        if workers is None:
+            workers = default_workers
+        self.workers = workers
+
+    @abc.abstractmethod
+    def query(self, x, k=1, eps=0, p=2.0, distance_upper_bound=np.inf):
+        """
+        Finds the ``k`` nearest generating samples to the points ``x``.
+
+        .. seealso::
+
+            :meth:`scipy.spatial.KDTree.query`
+
+        :param x: points for query
+        :type x: :class:`numpy.ndarray` of shape ``(*, dim)``
+        :param int k: number of nearest neighbors to return
+        :param float eps: return approximate nearest neighbors
+        :param float p: Which Minkowski p-norm to use. (1 <= p <= infinity)
+        :param float distance_upper_bound: only return neighbors within this
+            distance
+
+        :rtype: tuple
+        :returns: (dist, ptr)
+
+        """
+
+
+class kdtree_index(index_base):
+    """
+    Spatial index using the pure Python :class:`scipy.spatial.KDTree`.
+    """
+
+    def __init__(self, data, workers=None):
+        super(kdtree_index, self).__init__(data, workers)
+        self._tree = spatial.KDTree(self.data)
+        self.data = self._tree.data
+
+    def query(self, x, k=1, eps=0, p=2.0, distance_upper_bound=np.inf):
+        return self._tree.query(x, k=k, eps=eps, p=p,
+                                distance_upper_bound=distance_upper_bound)
+
+
+class ckdtree_index(index_base):
+    """
+    Spatial index using the compiled :class:`scipy.spatial.cKDTree`. Batch
+    queries are split across ``workers`` threads.
+    """
+
+    def __init__(self, data, workers=None):
+        super(ckdtree_index, self).__init__(data, workers)
+        self._tree = spatial.cKDTree(self.data)
+        self.data = self._tree.data
+
+    def query(self, x, k=1, eps=0, p=2.0, distance_upper_bound=np.inf):
+        kwargs = {_workers_kwarg: self.workers}
+        return self._tree.query(x, k=k, eps=eps, p=p,
+                                distance_upper_bound=distance_upper_bound,
+                                **kwargs)
+
+
+class brute_index(index_base):
+    """
+    Spatial index that computes the distance to every generating sample. For
+    the 2-norm the distances are computed with matrix products, so this is
+    fastest when there are few generating samples.
+    """
+
+    def __init__(self, data, workers=None):
+        super(brute_index, self).__init__(data, workers)
+        self.data = np.asarray(self.data, dtype=np.float64)
+        self._sq_norms = np.sum(self.data**2, axis=1)
+
+    def _block_distances(self, x, p):
+        """
+        Returns the distances between the points ``x`` and every generating
+        sample.
+        """
+        if p == 2:
+            dist = np.sum(x**2, axis=1)[:, np.newaxis] + self._sq_norms - \
+                2.0 * np.dot(x, self.data.T)
+            return np.sqrt(np.maximum(dist, 0.0))
+        return minkowski_distances(x, self.data, p)
+
+    def query(self, x, k=1, eps=0, p=2.0, distance_upper_bound=np.inf):
+        x = np.asarray(x, dtype=np.float64)
+        points = np.atleast_2d(x)
+        num = self.data.shape[0]
+        kk = min(k, num)
+        dist = np.full((points.shape[0], k), np.inf)
+        ptr = np.full((points.shape[0], k), num, dtype=np.int64)
+        block = max(1, int(max_block_size / max(num, 1)))
+        for start in range(0, points.shape[0], block):
+            x_block = points[start:start + block]
+            (_, ind) = _k_smallest(self._block_distances(x_block, p), kk)
+            # recompute the distances exactly for the chosen neighbors
+            exact = minkowski_norm(x_block[:, np.newaxis, :] -
+                                   self.data[ind], p)
+            order = np.argsort(exact, axis=1, kind='mergesort')
+            dist[start:start + block, :kk] = np.take_along_axis(exact, order,
+                                                                axis=1)
+            ptr[start:start + block, :kk] = np.take_along_axis(ind, order,
+                                                               axis=1)
+        (dist, ptr) = _fill_missing(dist, ptr, num, distance_upper_bound)
+        return _format_output(x, dist, ptr, k)
+
+
+class finite_index(index_base):
+    """
+    Spatial index over the generating samples that only contain finite
+    values. Rectangle and ball sample sets store non-finite placeholder
+    values, which :class:`scipy.spatial.KDTree` and
+    :class:`scipy.spatial.cKDTree` do not accept, so the index of another
+    backend is created over the finite rows and its pointers are mapped back
+    to rows of ``data``. Rows with non-finite values are never returned as
+    neighbors.
+    """
+
+    def __init__(self, data, backend=None, workers=None):
+        """
+        Initialization
+
+        :param data: generating samples
+        :type data: :class:`numpy.ndarray` of shape (num, dim)
+        :param string backend: name of the backend of the index over the
+            finite rows
+        :param int workers: number of threads to use for queries
+
+        """
+        super(finite_index, self).__init__(data, workers)
+        finite = np.all(np.isfinite(self.data), axis=1)
+        #: Rows of ``data`` followed by ``num`` for missing neighbors
+        self.rows = np.append(np.flatnonzero(finite), self.data.shape[0])
+        if np.any(finite):
+            #: Index over the finite rows of ``data``
+            self.index = build_index(self.data[finite], backend, workers)
+        else:
+            self.index = brute_index(self.data[finite], workers)
+
+    def query(self, x, k=1, eps=0, p=2.0, distance_upper_bound=np.inf):
+        (dist, ptr) = self.index.query(
+            x, k=k, eps=eps, p=p, distance_upper_bound=distance_upper_bound)
+        return (dist, self.rows[ptr])
+
+
+class rp_forest_index(index_base):
+    """
+    Approximate spatial index using a forest of random projection trees.
+    Each tree recursively splits the generating samples in half at the
+    median of their projections onto a random direction until at most
+    ``leaf_size`` samples remain. A point is compared to the samples in the
+    leaf it falls into in each tree, so the cost of a query does not grow
+    with the dimension the way it does for KD-trees, but a nearest neighbor
+    that is in none of these leaves is missed. More trees and larger leaves
+    miss fewer neighbors. ``eps`` is ignored.
+    """
+
+    def __init__(self, data, workers=None, n_trees=None, leaf_size=None,
+                 seed=None):
+        """
+        Initialization
+
+        :param data: generating samples
+        :type data: :class:`numpy.ndarray` of shape (num, dim)
+        :param int workers: number of threads to use for queries
+        :param int n_trees: number of trees, defaults to
+            :data:`rp_forest_trees`
+        :param int leaf_size: maximum number of samples in a leaf, defaults
+            to :data:`rp_forest_leaf_size`
+        :param int seed: seed of the random directions, defaults to
+            :data:`rp_forest_seed`
+
+        """
+        super(rp_forest_index, self).__init__(data, workers)
+        self.data = np.asarray(self.data, dtype=np.float64)
+        if n_trees is None:
+            n_trees = rp_forest_trees
+        if leaf_size is None:
+            leaf_size = rp_forest_leaf_size
+        if seed is None:
+            seed = rp_forest_seed
+        #: Number of trees
+        self.n_trees = n_trees
+        #: Maximum number of generating samples in a leaf
+        self.leaf_size = max(int(leaf_size), 1)
+        rng = np.random.RandomState(seed)
+        self._trees = [self._build_tree(rng) for _ in range(n_trees)]
+        self._padded_data = np.vstack([self.data,
+                                       np.full((1, self.data.shape[1]),
+                                               np.inf)])
+
+    def _build_tree(self, rng):
+        """
+        Builds a random projection tree. Nodes are stored as rows of arrays
+        of directions, thresholds, and children, where a negative child
+        ``-i-1`` is the leaf ``i``. Leaves are rows of generating sample
+        indices padded with ``num``.
+        """
+        (num, dim) = self.data.shape
+        nodes = []
+        leaves = []
+        stack = [(np.arange(num), None, None)]
+        root = None
+        while stack:
+            (index, parent, side) = stack.pop()
+            if index.shape[0] <= self.leaf_size:
+                leaves.append(index)
+                child = -len(leaves)
+            else:
+                direction = rng.standard_normal(dim)
+                proj = np.dot(self.data[index], direction)
+                order = np.argsort(proj, kind='mergesort')
+                half = index.shape[0] // 2
+                threshold = 0.5 * (proj[order[half - 1]] + proj[order[half]])
+                child = len(nodes)
+                nodes.append([direction, threshold, 0, 0])
+                stack.append((index[order[:half]], child, 2))
+                stack.append((index[order[half:]], child, 3))
+            if parent is None:
+                root = child
+            else:
+                nodes[parent][side] = child
+        leaf_table = np.full((len(leaves), self.leaf_size), num,
+                             dtype=np.int64)
+        for (i, leaf) in enumerate(leaves):
+            leaf_table[i, :leaf.shape[0]] = leaf
+        if nodes:
+            directions = np.array([node[0] for node in nodes])
+            thresholds = np.array([node[1] for node in nodes])
+            children = np.array([node[2:] for node in nodes], dtype=np.int64)
+        else:
+            directions = np.zeros((0, dim))
+            thresholds = np.zeros((0,))
+            children = np.zeros((0, 2), dtype=np.int64)
+        return (root, directions, thresholds, children, leaf_table)
+
+    def _candidates(self, points):
+        """
+        Returns the sorted indices of the generating samples in the leaves
+        the points fall into, with duplicates and padding set to ``num``.
+        """
+        cands = []
+        for (root, directions, thresholds, children, leaf_table) in \
+                self._trees:
+            node = np.full((points.shape[0],), root, dtype=np.int64)
+            inner = np.nonzero(node >= 0)[0]
+            while inner.shape[0] > 0:
+                current = node[inner]
+                proj = np.einsum('ij,ij->i', points[inner],
+                                 directions[current])
+                right = np.greater(proj, thresholds[current]).astype(np.int64)
+                node[inner] = children[current, right]
+                inner = inner[node[inner] >= 0]
+            cands.append(leaf_table[-node - 1])
+        cand = np.sort(np.concatenate(cands, axis=1), axis=1)
+        cand[:, 1:][cand[:, 1:] == cand[:, :-1]] = self.data.shape[0]
+        return cand
+
+    def query(self, x, k=1, eps=0, p=2.0, distance_upper_bound=np.inf):
+        x = np.asarray(x, dtype=np.float64)
+        points = np.atleast_2d(x)
+        num = self.data.shape[0]
+        dist = np.full((points.shape[0], k), np.inf)
+        ptr = np.full((points.shape[0], k), num, dtype=np.int64)
+        width = self.n_trees * self.leaf_size
+        kk = min(k, width)
+        block = max(1, int(max_block_size / (width * points.shape[1] + 1)))
+        for start in range(0, points.shape[0], block):
+            x_block = points[start:start + block]
+            cand = self._candidates(x_block)
+            with np.errstate(invalid='ignore'):
+                cand_dist = minkowski_norm(x_block[:, np.newaxis, :] -
+                                           self._padded_data[cand], p)
+            (kdist, ind) = _k_smallest(cand_dist, kk)
+            dist[start:start + block, :kk] = kdist
+            ptr[start:start + block, :kk] = np.take_along_axis(cand, ind,
+                                                               axis=1)
+        (dist, ptr) = _fill_missing(dist, ptr, num, distance_upper_bound)
+        return _format_output(x, dist, ptr, k)
+
+
+class grid_index(index_base):
+    """
+    Spatial index that hashes the generating samples into a regular grid of
+    buckets over their bounding box. A query searches growing blocks of
+    buckets around each point until no bucket outside of the block can hold a
+    closer generating sample. This is efficient for low dimensional spaces.
+    """
+
+    def __init__(self, data, workers=None, points_per_cell=2.0):
+        """
+        Initialization
+
+        :param data: generating samples
+        :type data: :class:`numpy.ndarray` of shape (num, dim)
+        :param int workers: number of threads to use for queries
+        :param float points_per_cell: average number of generating samples per
+            bucket
+
+        """
+        super(grid_index, self).__init__(data, workers)
+        self.data = np.asarray(self.data, dtype=np.float64)
+        (num, dim) = self.data.shape
+        cells = int(np.ceil((num / float(points_per_cell))**(1.0 / dim)))
+        #: Number of buckets per dimension
+        self.cells = np.full((dim,), max(cells, 1), dtype=np.int64)
+        #: Lower corner of the grid
+        self.lower = np.min(self.data, axis=0)
+        width = np.max(self.data, axis=0) - self.lower
+        width[width <= 0] = 1.0
+        #: Width of a bucket in each dimension
+        self.width = width / self.cells
+        keys = self._keys(self._cell_coords(self.data))
+        #: Indices of the generating samples sorted by bucket
+        self.order = np.argsort(keys, kind='mergesort')
+        #: Offsets of each bucket in ``self.order``
+        self.offsets = np.searchsorted(keys[self.order],
+                                       np.arange(np.prod(self.cells) + 1))
+
+    def _cell_coords(self, x):
+        """
+        Returns the integer bucket coordinates of the points ``x``.
+        """
+        coords = np.floor((x - self.lower) / self.width).astype(np.int64)
+        return np.clip(coords, 0, self.cells - 1)
+
+    def _keys(self, coords):
+        """
+        Returns the flat bucket index of the bucket coordinates ``coords``.
+        """
+        return np.ravel_multi_index(tuple(coords.T), tuple(self.cells))
+
+    def _candidates(self, low, high):
+        """
+        Returns the indices of generating samples in the block of buckets with
+        corners ``low`` and ``high`` (inclusive).
+        """
+        ranges = [np.arange(l, h + 1) for (l, h) in zip(low, high)]
+        block = np.meshgrid(*ranges, indexing='ij')
+        keys = np.ravel_multi_index(tuple(b.ravel() for b in block),
+                                    tuple(self.cells))
+        return np.concatenate([self.order[self.offsets[key]:
+                                          self.offsets[key + 1]]
+                               for key in keys])
+
+    def _lower_bound(self, x, low, high):
+        """
+        Returns a lower bound for the distance from each point in ``x`` to any
+        generating sample outside of the block of buckets.
+        """
+        block_lower = self.lower + low * self.width
+        block_upper = self.lower + (high + 1) * self.width
+        below = np.where(low > 0, x - block_lower, np.inf)
+        above = np.where(high < self.cells - 1, block_upper - x, np.inf)
+        return np.min(np.minimum(below, above), axis=1)
+
+    def query(self, x, k=1, eps=0, p=2.0, distance_upper_bound=np.inf):
+        x = np.asarray(x, dtype=np.float64)
+        points = np.atleast_2d(x)
+        num = self.data.shape[0]
+        kk = min(k, num)
+        dist = np.full((points.shape[0], k), np.inf)
+        ptr = np.full((points.shape[0], k), num, dtype=np.int64)
+
+        coords = self._cell_coords(points)
+        keys = self._keys(coords)
+        point_order = np.argsort(keys, kind='mergesort')
+        (unique_keys, starts) = np.unique(keys[point_order],
+                                          return_index=True)
+        ends = np.append(starts[1:], points.shape[0])
+
+        for (start, end) in zip(starts, ends):
+            group = point_order[start:end]
+            cell = coords[group[0]]
+            x_group = points[group]
+            reach = 0
+            while True:
+                low = np.maximum(cell - reach, 0)
+                high = np.minimum(cell + reach, self.cells - 1)
+                cand = self._candidates(low, high)
+                covered = np.all(low == 0) and np.all(high == self.cells - 1)
+                if cand.shape[0] >= kk:
+                    bound = self._lower_bound(x_group, low, high)
+                    cand_dist = minkowski_norm(x_group[:, np.newaxis, :] -
+                                               self.data[cand], p)
+                    (kdist, kind) = _k_smallest(cand_dist, kk)
+                    if covered or np.all(np.minimum(kdist[:, -1],
+                                                    distance_upper_bound)
+                                         <= bound):
+                        break
+                reach += 1
+            dist[group, :kk] = kdist
+            ptr[group, :kk] = cand[kind]
+
+        (dist, ptr) = _fill_missing(dist, ptr, num, distance_upper_bound)
+        return _format_output(x, dist, ptr, k)
+
+
+class box_index(object):
+    r"""
+    Index locating points within a set of hyperrectangles
+    :math:`(l_i, r_i]`. The space is divided into a grid of buckets whose
+    edges are the sorted rectangle edges along each axis (or a regular grid
+    when that would create too many buckets) and each bucket stores the
+    rectangles overlapping it. A query locates the bucket of each point with
+    a binary search along each axis and then only checks the rectangles in
+    that bucket.
+    """
+
+    def __init__(self, left, right, max_buckets=None):
+        """
+        Initialization
+
+        :param left: lower corners of the hyperrectangles
+        :type left: :class:`numpy.ndarray` of shape (num, dim)
+        :param right: upper corners of the hyperrectangles
+        :type right: :class:`numpy.ndarray` of shape (num, dim)
+        :param int max_buckets: maximum number of buckets
+
+        """
+        #: Lower corners of the hyperrectangles
+        self.left = np.asarray(left, dtype=np.float64)
+        #: Upper corners of the hyperrectangles
+        self.right = np.asarray(right, dtype=np.float64)
+        (num, dim) = self.left.shape
+        if max_buckets is None:
+            max_buckets = max(8 * num, 4096)
+        #: Bucket edges along each axis
+        self.edges = self._bucket_edges(max_buckets)
+        self.shape = tuple(len(e) - 1 for e in self.edges)
+
+        # find the range of buckets each rectangle overlaps
+        low = np.empty((num, dim), dtype=np.int64)
+        high = np.empty((num, dim), dtype=np.int64)
+        for i, edges in enumerate(self.edges):
+            low[:, i] = np.searchsorted(edges, self.left[:, i], 'right') - 1
+            high[:, i] = np.searchsorted(edges, self.right[:, i], 'left') - 1
+        low = np.clip(low, 0, np.array(self.shape) - 1)
+        high = np.clip(high, low, np.array(self.shape) - 1)
+
+        # enumerate every (bucket, rectangle) pair
+        span = high - low + 1
+        counts = np.prod(span, axis=1)
+        rect = np.repeat(np.arange(num), counts)
+        local = np.arange(np.sum(counts)) - np.repeat(np.cumsum(counts) -
+                                                      counts, counts)
+        coords = np.empty((rect.shape[0], dim), dtype=np.int64)
+        for i in range(dim - 1, -1, -1):
+            coords[:, i] = low[rect, i] + local % span[rect, i]
+            local = local // span[rect, i]
+        keys = np.ravel_multi_index(tuple(coords.T), self.shape)
+
+        # store rectangles sorted by bucket and then by index
+        order = np.lexsort((rect, keys))
+        #: Rectangle indices sorted by bucket
+        self.rects = rect[order]
+        #: Offsets of each bucket in ``self.rects``
+        self.offsets = np.searchsorted(keys[order],
+                                       np.arange(np.prod(self.shape) + 1))
+
+    def _bucket_edges(self, max_buckets):
+        """
+        Returns the bucket edges along each axis. The outer buckets extend to
+        infinity so that every point belongs to a bucket.
+        """
+        dim = self.left.shape[1]
+        bounds = np.concatenate((self.left, self.right))
+        edges = []
+        for i in range(dim):
+            finite = bounds[:, i][np.isfinite(bounds[:, i])]
+            edges.append(np.unique(finite))
+        if np.prod([len(e) + 1.0 for e in edges]) > max_buckets:
+            # use a regular grid with roughly max_buckets buckets
+            cells = max(int((max_buckets)**(1.0 / dim)) - 2, 1)
+            edges = [np.linspace(e[0], e[-1], min(cells, len(e) - 1) + 1)
+                     if len(e) > 1 else e for e in edges]
+        return [np.concatenate(([-np.inf], e, [np.inf])) for e in edges]
+
+    def query(self, x, k=1, eps=0, p=2.0, distance_upper_bound=np.inf):
+        """
+        Finds the first ``k`` hyperrectangles (by index) containing the points
+        ``x``. The distance is 0 if a point is in the hyperrectangle. Missing
+        neighbors are given the distance ``inf`` and the index ``num``.
+
+        :param x: points for query
+        :type x: :class:`numpy.ndarray` of shape ``(*, dim)``
+        :param int k: number of hyperrectangles to return
+
+        :rtype: tuple
+        :returns: (dist, ptr)
+
+        """
+        x = np.asarray(x)
+        points = np.atleast_2d(x)
+        num = self.left.shape[0]
+        dist = np.full((points.shape[0], k), np.inf)
+        ptr = np.full((points.shape[0], k), num, dtype=np.int64)
+
+        # locate the bucket of each point
+        coords = np.empty(points.shape, dtype=np.int64)
+        for i, edges in enumerate(self.edges):
+            coords[:, i] = np.searchsorted(edges, points[:, i], 'left') - 1
+        coords = np.clip(coords, 0, np.array(self.shape) - 1)
+        keys = np.ravel_multi_index(tuple(coords.T), self.shape)
+        starts = self.offsets[keys]
+        counts = self.offsets[keys + 1] - starts
+
+        # check the candidate rectangles in blocks of points
+        cum_counts = np.cumsum(counts)
+        begin = 0
+        while begin < points.shape[0]:
+            done = cum_counts[begin - 1] if begin > 0 else 0
+            end = max(np.searchsorted(cum_counts, done + max_block_size,
+                                      'right'), begin + 1)
+            block_counts = counts[begin:end]
+            point = np.repeat(np.arange(begin, end), block_counts)
+            local = np.arange(point.shape[0]) - \
+                np.repeat(np.cumsum(block_counts) - block_counts, block_counts)
+            cand = self.rects[starts[point] + local]
+            inside = np.all(np.logical_and(
+                np.greater(points[point], self.left[cand]),
+                np.less_equal(points[point], self.right[cand])), axis=1)
+            point = point[inside]
+            cand = cand[inside]
+            _first_k(point, cand, dist, ptr, k)
+            begin = end
+
+        return _format_output(x, dist, ptr, k)
+
+
+def meshgrid_order(dim):
+    """
+    Returns the order of the axes (slowest varying first) in which the cells
+    of a Cartesian grid are enumerated by stacking the transposed
+    :meth:`numpy.meshgrid` (with the default ``'xy'`` indexing) of the grid
+    coordinates.
+
+    :param int dim: dimension of the grid
+
+    :rtype: list
+    :returns: axes ordered from slowest to fastest varying
+
+    """
+    if dim == 1:
+        return [0]
+    return list(range(dim - 1, 1, -1)) + [0, 1]
+
+
+class cartesian_index(object):
+    r"""
+    Index locating points within the cells :math:`(x_{i}, x_{i+1}]` of a
+    Cartesian grid. Only the coordinates of the grid along each axis are
+    stored and each point is located with a binary search along each axis.
+    """
+
+    def __init__(self, xi):
+        """
+        Initialization
+
+        :param xi: x1, x2,..., xn, 1-D arrays representing the coordinates of a
+            grid
+        :type xi: list of :class:`numpy.ndarray`
+
+        """
+        #: Coordinates of the grid along each axis
+        self.xi = [np.asarray(xv, dtype=np.float64) for xv in xi]
+        #: Order of the axes used to enumerate the cells
+        self.order = meshgrid_order(len(self.xi))
+        #: Number of cells along each axis in ``self.order``
+        self.shape = tuple(len(self.xi[i]) - 1 for i in self.order)
+
+    def query(self, x, k=1, eps=0, p=2.0, distance_upper_bound=np.inf):
+        """
+        Finds the cell containing each of the points ``x``. The distance is 0
+        if a point is in a cell. Points outside of the grid and missing
+        neighbors for ``k > 1`` are given the distance ``inf`` and the index
+        ``num``.
+
+        :param x: points for query
+        :type x: :class:`numpy.ndarray` of shape ``(*, dim)``
+        :param int k: number of cells to return
+
+        :rtype: tuple
+        :returns: (dist, ptr)
+
+        """
+        x = np.asarray(x)
+        points = np.atleast_2d(x)
+        num = int(np.prod(self.shape))
+        dist = np.full((points.shape[0], k), np.inf)
+        ptr = np.full((points.shape[0], k), num, dtype=np.int64)
+
+        inside = np.ones((points.shape[0],), dtype=bool)
+        coords = []
+        for (i, n) in zip(self.order, self.shape):
+            coord = np.searchsorted(self.xi[i], points[:, i], 'left') - 1
+            inside = np.logical_and(inside, np.logical_and(coord >= 0,
+                                                           coord < n))
+            coords.append(coord)
+        coords = tuple(coord[inside] for coord in coords)
+        ptr[inside, 0] = np.ravel_multi_index(coords, self.shape)
+        dist[inside, 0] = 0.0
+        return _format_output(x, dist, ptr, k)
+
+
+class ball_index(object):
+    r"""
+    Index locating points within a set of balls
+    :math:`\{x : \|x - c_i\|_p < r_i\}`. A :class:`scipy.spatial.cKDTree` over
+    the centers finds every center within the largest radius of a point and
+    these candidates are then checked against the radius of each ball.
+    """
+
+    def __init__(self, centers, radii):
+        """
+        Initialization
+
+        :param centers: centers of the balls
+        :type centers: :class:`numpy.ndarray` of shape (num, dim)
+        :param radii: radii of the balls
+        :type radii: :class:`numpy.ndarray` of shape (num,)
+
+        """
+        #: Centers of the balls
+        self.centers = np.asarray(centers, dtype=np.float64)
+        #: Radii of the balls
+        self.radii = np.asarray(radii, dtype=np.float64)
+        if self.centers.shape[0] > 0:
+            self._tree = spatial.cKDTree(self.centers)
+            # pad the search radius so that rounding in the tree never
+            # excludes a candidate
+            self._max_radius = np.max(self.radii) * (1.0 + 1E-10)
+        else:
+            self._tree = None
+
+    def query(self, x, k=1, eps=0, p=2.0, distance_upper_bound=np.inf):
+        """
+        Finds the first ``k`` balls (by index) containing the points ``x``.
+        The distance is 0 if a point is in the ball. Missing neighbors are
+        given the distance ``inf`` and the index ``num``.
+
+        :param x: points for query
+        :type x: :class:`numpy.ndarray` of shape ``(*, dim)``
+        :param int k: number of balls to return
+        :param float p: Which Minkowski p-norm to use. (1 <= p <= infinity)
+
+        :rtype: tuple
+        :returns: (dist, ptr)
+
+        """
+        x = np.asarray(x)
+        points = np.atleast_2d(x)
+        num = self.centers.shape[0]
+        dist = np.full((points.shape[0], k), np.inf)
+        ptr = np.full((points.shape[0], k), num, dtype=np.int64)
+        if self._tree is None:
+            return _format_output(x, dist, ptr, k)
+
+        block = max(1, int(max_block_size / 64))
+        for start in range(0, points.shape[0], block):
+            x_block = points[start:start + block]
+            near = self._tree.query_ball_point(x_block, self._max_radius, p=p)
+            counts = np.array([len(n) for n in near], dtype=np.int64)
+            if np.sum(counts) == 0:
+                continue
+            point = np.repeat(np.arange(x_block.shape[0]), counts)
+            cand = np.concatenate([n for n in near if len(n) > 0]).astype(
+                np.int64)
+            inside = minkowski_within(x_block[point] - self.centers[cand],
+                                      self.radii[cand], p)
+            point = point[inside]
+            cand = cand[inside]
+            order = np.lexsort((cand, point))
+            _first_k(point[order] + start, cand[order], dist, ptr, k)
+        return _format_output(x, dist, ptr, k)
+
+
+class incremental_index(object):
+    """
+    Spatial index over a growing set of generating samples. The samples are
+    covered by static indices over contiguous blocks of rows and the most
+    recently appended rows are searched with a :class:`brute_index`. When more
+    than ``buffer_size`` rows have been appended they become a new block, and
+    blocks are merged like the digits of a binary counter (a block is rebuilt
+    together with every preceding block that is not larger). Each row is
+    therefore rebuilt into a static index O(log(num)) times and a query
+    searches O(log(num)) indices.
+
+    :meth:`extend` returns a new index, so an index can be shared between
+    sample sets.
+    """
+
+    def __init__(self, index, backend=None, workers=None, buffer_size=64):
+        """
+        Initialization
+
+        :param index: static index over the generating samples
+        :type index: :class:`~bet.spatialIndex.index_base`
+        :param string backend: name of the backend used for new blocks
+        :param int workers: number of threads to use for queries
+        :param int buffer_size: maximum number of rows searched by brute force
+
+        """
+        #: Generating samples, :class:`numpy.ndarray` of shape (num, dim)
+        self.data = index.data
+        #: Name of the backend used for new blocks
+        self.backend = backend
+        #: Number of threads to use for queries
+        self.workers = index.workers
+        if workers is not None:
+            self.workers = workers
+        #: Maximum number of rows searched by brute force
+        self.buffer_size = buffer_size
+        #: List of (first row, static index) covering the first rows
+        self.blocks = [(0, index)]
+        self._tail = None
+
+    @property
+    def num_static(self):
+        """
+        Number of rows covered by the static indices.
+        """
+        (start, index) = self.blocks[-1]
+        return start + index.data.shape[0]
+
+    def extend(self, data):
+        """
+        Returns an index over ``data`` whose first rows are the generating
+        samples of this index.
+
+        :param data: generating samples
+        :type data: :class:`numpy.ndarray` of shape (new_num, dim)
+
+        :rtype: :class:`~bet.spatialIndex.incremental_index`
+        :returns: index over ``data``
+
+        """
+        new_index = copy.copy(self)
+        new_index.data = data
+        new_index.blocks = list(self.blocks)
+        new_index._tail = None
+        num_static = self.num_static
+        if data.shape[0] - num_static > self.buffer_size:
+            start = num_static
+            while len(new_index.blocks) > 0 and \
+                    new_index.blocks[-1][1].data.shape[0] <= \
+                    data.shape[0] - start:
+                start = new_index.blocks.pop()[0]
+            new_index.blocks.append((start, build_index(data[start:],
+                                                        self.backend,
+                                                        self.workers)))
+        return new_index
+
+    def query(self, x, k=1, eps=0, p=2.0, distance_upper_bound=np.inf):
+        """
+        Finds the ``k`` nearest generating samples to the points ``x``.
+
+        .. seealso::
+
+            :meth:`scipy.spatial.KDTree.query`
+
+        :param x: points for query
+        :type x: :class:`numpy.ndarray` of shape ``(*, dim)``
+        :param int k: number of nearest neighbors to return
+        :param float eps: return approximate nearest neighbors
+        :param float p: Which Minkowski p-norm to use. (1 <= p <= infinity)
+        :param float distance_upper_bound: only return neighbors within this
+            distance
+
+        :rtype: tuple
+        :returns: (dist, ptr)
+
+        """
+        x = np.asarray(x)
+        points = np.atleast_2d(x)
+        num = self.data.shape[0]
+        num_static = self.num_static
+        blocks = list(self.blocks)
+        if num > num_static:
+            if self._tail is None:
+                self._tail = brute_index(self.data[num_static:], self.workers)
+            blocks.append((num_static, self._tail))
+
+        dists = []
+        ptrs = []
+        for (start, index) in blocks:
+            (dist, ptr) = index.query(points, k=k, eps=eps, p=p,
+                                      distance_upper_bound=distance_upper_bound)
+            dist = np.reshape(dist, (points.shape[0], k))
+            ptr = np.reshape(ptr, (points.shape[0], k)) + start
+            ptr[np.isinf(dist)] = num
+            dists.append(dist)
+            ptrs.append(ptr)
+        dist = np.concatenate(dists, axis=1)
+        ptr = np.concatenate(ptrs, axis=1)
+        order = np.argsort(dist, axis=1, kind='mergesort')[:, :k]
+        dist = np.take_along_axis(dist, order, axis=1)
+        ptr = np.take_along_axis(ptr, order, axis=1)
+        return _format_output(x, dist, ptr, k)
+
+
+#: Dictionary of available spatial index backends
+backends = {'kdtree': kdtree_index,
+            'ckdtree': ckdtree_index,
+            'brute': brute_index,
+            'grid': grid_index,
+            'rpforest': rp_forest_index}
+
+
+def set_default_backend(backend, workers=None):
+    """
+    Sets the spatial index backend used by sample sets that do not specify
+    their own backend.
+
+    :param string backend: name of the backend, one of ``'kdtree'``,
+        ``'ckdtree'``, ``'brute'``, ``'grid'``, or ``'rpforest'``
+    :param int workers: number of threads to use for queries, ``-1`` uses all
+        available threads
+
+    """
+    global default_backend, default_workers
+    if backend not in backends:
+        raise unknown_backend("{} is not a spatial index backend".format(
+            backend))
+    default_backend = backend
+    if workers is not None:
+        default_workers = workers
+
+
+def build_index(data, backend=None, workers=None):
+    """
+    Creates a spatial index over the generating samples ``data``.
+
+    :param data: generating samples
+    :type data: :class:`numpy.ndarray` of shape (num, dim)
+    :param string backend: name of the backend, defaults to
+        :data:`default_backend`
+    :param int workers: number of threads to use for queries, defaults to
+        :data:`default_workers`
+
+    :rtype: :class:`~bet.spatialIndex.index_base`
+    :returns: spatial index over ``data``
+
+    """
+    if backend is None:
+        backend = default_backend
+    if backend not in backends:
+        raise unknown_backend("{} is not a spatial index backend".format(
+            backend))
+    if not np.all(np.isfinite(data)):
+        # rectangle and ball sample sets store non-finite placeholder values
+        logging.info("Non-finite values, indexing the finite values only.")
+        return finite_index(data, backend, workers)
+    return backends[backend](data, workers)
@@ -0,0 +1,303 @@
+# Copyright (C) 2014-2019 The BET Development Team
+
+"""
+This module contains the native chunked file format used to save
+:class:`bet.sample.sample_set_base` and :class:`bet.sample.discretization`
+objects. A file is a directory (by convention with a ``.bet`` extension)
+containing a ``metadata.json`` file and one or more ``.npy`` (or compressed
+``.npz``) chunk files per array. Unlike MATLAB-style ``.mat`` files this
+format
+
+* has no limit on the size of an array,
+* adds or replaces arrays without rewriting the rest of the file,
+* appends rows to an array by writing a new chunk,
+* reads a range of rows of an array without reading the other rows, and
+* can memory map arrays instead of reading them into memory.
+
+:class:`~bet.storage.chunked_file` provides dictionary-like access to a file,
+:meth:`~bet.storage.is_chunked_file` checks whether a path is such a file.
+"""
+
+import os
+import json
+import numpy as np
+
+#: Extension of files in the chunked format
+extension = '.bet'
+#: Version of the chunked format written by this module
+format_version = 1
+_metadata_name = 'metadata.json'
+
+
+class not_chunked_file(Exception):
+    """
+    Exception for when a path is not a file in the chunked format.
+    """
+
+
+def is_chunked_file(file_name):
+    """
+    Checks whether ``file_name`` is a file in the chunked format.
+
+    :param string file_name: name of the file
+
+    :rtype: bool
+    :returns: whether ``file_name`` is a chunked file
+
+    """
+    return os.path.isfile(os.path.join(file_name, _metadata_name))
+
+
+def _safe_name(key):
+    """
+    Returns a version of ``key`` that can be used as a file name.
+    """
+    return "".join(c if c.isalnum() or c in '_-' else '_' for c in key)
+
+
+class chunked_file(object):
+    """
+    Dictionary-like access to a file in the chunked format. Reading an entry
+    returns a :class:`numpy.ndarray`, setting an entry writes it to disk
+    immediately, and only ``metadata.json`` is rewritten when entries are
+    added, removed, or appended to.
+
+    """
+
+    def __init__(self, file_name, mode='r', mmap_mode=None, compress=False):
+        """
+        Opens a chunked file.
+
+        :param string file_name: name of the file (a directory)
+        :param string mode: ``'r'`` to read an existing file, ``'a'`` to
+            read and write, creating the file if necessary
+        :param string mmap_mode: if not ``None`` uncompressed arrays are
+            memory mapped with this mode (see :func:`numpy.load`)
+        :param bool compress: whether or not to compress chunks written to
+            this file
+
+        """
+        #: Name of the file
+        self.file_name = file_name
+        #: Mode the file was opened with
+        self.mode = mode
+        #: Mode used to memory map arrays, ``None`` reads them into memory
+        self.mmap_mode = mmap_mode
+        #: Whether or not chunks written to this file are compressed
+        self.compress = compress
+        if is_chunked_file(file_name):
+            with open(os.path.join(file_name, _metadata_name)) as f:
+                self._metadata = json.load(f)
+        elif mode == 'a':
+            if not os.path.exists(file_name):
+                os.makedirs(file_name)
+            self._metadata = {'format_version': format_version,
+                              'entries': {}}
+            self.flush()
+        else:
+            raise not_chunked_file("{} is not a chunked file".format(
+                file_name))
+
+    def _check_writable(self):
+        """
+        Raises an error if this file was opened read-only.
+        """
+        if self.mode != 'a':
+            raise IOError("{} is opened read-only".format(self.file_name))
+
+    def flush(self):
+        """
+        Writes the metadata of this file to disk.
+        """
+        self._check_writable()
+        metadata_file = os.path.join(self.file_name, _metadata_name)
+        with open(metadata_file + '.tmp', 'w') as f:
+            json.dump(self._metadata, f)
+        os.replace(metadata_file + '.tmp', metadata_file)
+
+    def keys(self):
+        """
+        :rtype: list
+        :returns: names of the entries in this file
+        """
+        return list(self._metadata['entries'].keys())
+
+    def __contains__(self, key):
+        return key in self._metadata['entries']
+
+    def __getitem__(self, key):
+        return self.read(key)
+
+    def __setitem__(self, key, value):
+        self.write(key, value)
+
+    def shape(self, key):
+        """
+        Returns the shape of an entry without reading it.
+
+        :param string key: name of the entry
+
+        :rtype: tuple
+        :returns: shape of the entry
+        """
+        return tuple(self._metadata['entries'][key]['shape'])
+
+    def _write_chunk(self, key, array):
+        """
+        Writes ``array`` to a new chunk file and returns the chunk metadata.
+        """
+        entry = self._metadata['entries'].get(key, {'chunks': []})
+        number = len(entry['chunks'])
+        chunk_name = "{}.{}".format(_safe_name(key), number)
+        while os.path.exists(os.path.join(self.file_name, chunk_name +
+                                          '.npy')) or os.path.exists(
+                os.path.join(self.file_name, chunk_name + '.npz')):
+            number += 1
+            chunk_name = "{}.{}".format(_safe_name(key), number)
+        if self.compress:
+            chunk_name += '.npz'
+            np.savez_compressed(os.path.join(self.file_name, chunk_name),
+                                arr=array)
+        else:
+            chunk_name += '.npy'
+            np.save(os.path.join(self.file_name, chunk_name), array)
+        return {'file': chunk_name,
+                'rows': int(array.shape[0]) if array.ndim > 0 else 1}
+
+    def _remove_chunks(self, entry):
+        """
+        Deletes the chunk files of an entry.
+        """
+        for chunk in entry['chunks']:
+            chunk_file = os.path.join(self.file_name, chunk['file'])
+            if os.path.exists(chunk_file):
+                os.remove(chunk_file)
+
+    def write(self, key, value):
+        """
+        Writes ``value`` as the entry ``key``, replacing an existing entry
+        with the same name.
+
+        :param string key: name of the entry
+        :param value: array to write, strings are stored as arrays of shape
+            (1,)
+        :type value: :class:`numpy.ndarray`
+
+        """
+        self._check_writable()
+        if isinstance(value, str):
+            value = np.array([value])
+        value = np.asarray(value)
+        chunk = self._write_chunk(key, value)
+        if key in self._metadata['entries']:
+            self._remove_chunks(self._metadata['entries'][key])
+        self._metadata['entries'][key] = {'shape': list(value.shape),
+                                          'dtype': value.dtype.str,
+                                          'chunks': [chunk]}
+        self.flush()
+
+    def append(self, key, value):
+        """
+        Appends the rows of ``value`` to the entry ``key`` by writing them to
+        a new chunk. Existing chunks are not read or rewritten.
+
+        :param string key: name of the entry
+        :param value: rows to append
+        :type value: :class:`numpy.ndarray` of shape (N, ...)
+
+        """
+        self._check_writable()
+        if key not in self._metadata['entries']:
+            return self.write(key, value)
+        entry = self._metadata['entries'][key]
+        value = np.asarray(value, dtype=np.dtype(entry['dtype']))
+        if len(entry['shape']) == 0 or \
+                list(value.shape[1:]) != entry['shape'][1:]:
+            raise ValueError("Shape {} of the rows does not match the shape "
+                             "{} of {}".format(value.shape, entry['shape'],
+                                               key))
+        entry['chunks'].append(self._write_chunk(key, value))
+        entry['shape'][0] += int(value.shape[0])
+        self.flush()
+
+    def pop(self, key, default=None):
+        """
+        Removes the entry ``key`` from this file.
+
+        :param string key: name of the entry
+        :param default: returned if there is no such entry
+
+        """
+        self._check_writable()
+        if key not in self._metadata['entries']:
+            return default
+        entry = self._metadata['entries'].pop(key)
+        self.flush()
+        self._remove_chunks(entry)
+
+    def _read_chunk(self, chunk, mmap_mode=None):
+        """
+        Reads (or memory maps) a single chunk.
+
+        :param dict chunk: metadata of the chunk
+        :param string mmap_mode: mode used to memory map the chunk,
+            ``self.mmap_mode`` by default
+
+        """
+        chunk_file = os.path.join(self.file_name, chunk['file'])
+        if chunk_file.endswith('.npz'):
+            with np.load(chunk_file) as data:
+                return data['arr']
+        if mmap_mode is None:
+            mmap_mode = self.mmap_mode
+        return np.load(chunk_file, mmap_mode=mmap_mode)
+
+    def _read_chunk_rows(self, chunk, start, stop, copy=False):
+        """
+        Reads the rows ``start:stop`` of a single chunk. If ``copy`` the
+        chunk is memory mapped read-only and only these rows are copied out,
+        so the rest of the chunk is neither read nor kept alive by the result.
+        """
+        if copy:
+            return np.array(self._read_chunk(chunk, mmap_mode='r')[start:
+                                                                   stop])
+        return self._read_chunk(chunk)[start:stop]
+
+    def read(self, key, rows=None):
+        """
+        Reads the entry ``key``. If ``rows`` is given only the chunks
+        containing these rows are read.
+
+        :param string key: name of the entry
+        :param rows: range of rows to read, all rows by default
+        :type rows: :class:`slice` with step ``None`` or 1
+
+        :rtype: :class:`numpy.ndarray`
+        :returns: the entry (a :class:`numpy.memmap` if memory mapped from
+            a single chunk)
+
+        """
+        entry = self._metadata['entries'][key]
+        chunks = entry['chunks']
+        if len(entry['shape']) == 0:
+            return self._read_chunk(chunks[0])
+        # copy ranges of rows out of read-only memory maps instead of
+        # loading whole chunks
+        copy = rows is not None and self.mmap_mode is None
+        if rows is None:
+            rows = slice(None)
+        (start, stop, _) = rows.indices(entry['shape'][0])
+        stop = max(start, stop)
+        if len(chunks) == 1:
+            return self._read_chunk_rows(chunks[0], start, stop, copy)
+        pieces = []
+        offset = 0
+        for chunk in chunks:
+            if offset < stop and offset + chunk['rows'] > start:
+                pieces.append(self._read_chunk_rows(
+                    chunk, max(start - offset, 0), stop - offset, copy))
+            offset += chunk['rows']
+        if len(pieces) == 0:
+            return np.empty([0] + entry['shape'][1:],
+                            dtype=np.dtype(entry['dtype']))
+        return np.concatenate(pieces)
@@ -7,7 +7,7 @@ import numpy as np
 import bet.sample as sample
 import bet.calculateP.calculateError as calculateError
 import bet.calculateP.calculateP as calculateP
-from bet.Comm import comm, MPI
+import bet.util as util
 
 
 class piecewise_polynomial_surrogate(object):
@@ -167,16 +167,10 @@ class piecewise_polynomial_surrogate(object):
         # Update input only if 1 region is given
         if update_input:
             num = self.input_disc._input_sample_set.check_num()
-            prob = np.zeros((num,))
-            error_id = np.zeros((num,))
-            for i in range(num):
-                Itemp = np.equal(self.dummy_disc._emulated_ii_ptr_local, i)
-                prob_sum = np.sum(self.surrogate_discretization.
-                                  _input_sample_set._probabilities_local[Itemp])
-                prob[i] = comm.allreduce(prob_sum, op=MPI.SUM)
-                error_id_sum = np.sum(self.surrogate_discretization.
-                                      _input_sample_set._error_id_local[Itemp])
-                error_id[i] = comm.allreduce(error_id_sum, op=MPI.SUM)
+            sur_set = self.surrogate_discretization._input_sample_set
+            (_, [prob, error_id]) = util.cell_sums(
+                self.dummy_disc._emulated_ii_ptr_local, num,
+                [sur_set._probabilities_local, sur_set._error_id_local])
             self.input_disc._input_sample_set.set_probabilities(prob)
             self.input_disc._input_sample_set.set_error_id(error_id)
 
@@ -62,6 +62,42 @@ def meshgrid_ndim(X):
     return X_new
 
 
+def get_mpi_type(dtype):
+    """
+    Returns the MPI datatype matching the numpy ``dtype`` exactly, so that
+    single precision arrays and compact pointers are not communicated as
+    double precision or 64-bit integers.
+
+    :param dtype: numpy data type
+    :rtype: MPI datatype
+    :returns: the MPI datatype or ``None`` if there is none
+
+    """
+    typedict = getattr(MPI, '_typedict', None)
+    if typedict is None:
+        # without mpi4py only the types in possible_types exist
+        return {np.dtype(ptype): mpi_type for (ptype, mpi_type) in
+                possible_types.items()}.get(np.dtype(dtype))
+    return typedict.get(np.dtype(dtype).char)
+
+
+def index_dtype(num):
+    """
+    Returns the smallest integer type used for pointers to ``num`` cells.
+    Pointers may be equal to ``num`` for points that are not in any cell.
+    The types considered are 32-bit and 64-bit integers, smaller types would
+    overflow in arithmetic on pointers.
+
+    :param int num: number of cells
+    :rtype: :class:`numpy.dtype`
+    :returns: integer type
+
+    """
+    if num < np.iinfo(np.int32).max:
+        return np.dtype(np.int32)
+    return np.dtype(np.int64)
+
+
 def get_global_values(array, shape=None):
     """
     Concatenates local arrays into global array using :meth:`np.vstack`.
@@ -74,21 +110,10 @@ def get_global_values(array, shape=None):
     if comm.size == 1:
         return array
     else:
-        # Figure out the subtype of the elements of the array
-        dtype = array.dtype
-        mpi_dtype = False
-        for ptype in possible_types.keys():
-            # suppress FutureWarning
-            if ptype is int or ptype is MPI.INT:
-                comp_type = np.integer
-            elif ptype is float or ptype is MPI.FLOAT:
-                comp_type = np.floating
-
-            if np.issubdtype(dtype, comp_type):
-                mpi_dtype = True
-                dtype = ptype
-
-        if shape is None or not mpi_dtype:
+        # Figure out the MPI type matching the elements of the array
+        mpi_type = get_mpi_type(array.dtype)
+
+        if shape is None or mpi_type is None:
             # do a lowercase allgather
             a_shape = len(array.shape)
             array = comm.allgather(array)
@@ -98,12 +123,115 @@ def get_global_values(array, shape=None):
                 return np.vstack(array)
         else:
             # do an uppercase Allgather
-            whole_a = np.empty(shape, dtype=dtype)
-            comm.Allgather([array.ravel(), possible_types[dtype]], [whole_a,
-                                                                    possible_types[dtype]])
+            whole_a = np.empty(shape, dtype=array.dtype)
+            comm.Allgather([np.ascontiguousarray(array).ravel(), mpi_type],
+                           [whole_a, mpi_type])
             return whole_a
 
 
+def cell_sums(ptr, num, weights=None, globalize=True):
+    """
+    Counts the number of entries of ``ptr`` equal to each cell index
+    ``0, ..., num-1`` and sums each array of ``weights`` over the entries in
+    each cell. Entries of ``ptr`` outside of ``[0, num)`` are ignored.
+
+    The sums agree bit for bit with ``np.sum(w[np.equal(ptr, i)])`` and, if
+    ``globalize``, the counts and sums are added up over all processors with
+    a single :meth:`~mpi4py.MPI.Comm.Allreduce`. Besides sorting ``ptr``,
+    the cost is one vectorized sum per distinct number of entries in a cell.
+
+    :param ptr: cell pointers
+    :type ptr: :class:`~numpy.ndarray` of shape (N,)
+    :param int num: number of cells
+    :param weights: arrays to sum over each cell
+    :type weights: list of :class:`~numpy.ndarray` of shape (N,)
+    :param bool globalize: sum the counts and sums over all processors
+    :rtype: tuple
+    :returns: (counts, sums) where ``counts`` is a :class:`~numpy.ndarray` of
+        shape (num,) and ``sums`` is a list of :class:`~numpy.ndarray` of
+        shape (num,)
+    """
+    ptr = np.ravel(ptr).astype(np.int64)
+    if weights is None:
+        weights = []
+    weights = [np.ravel(w) for w in weights]
+    # single precision weights are summed in double precision
+    weights = [w.astype(np.float64, copy=False) if w.dtype.kind == 'f' else w
+               for w in weights]
+    valid = np.logical_and(np.greater_equal(ptr, 0), np.less(ptr, num))
+    if not np.all(valid):
+        ptr = ptr[valid]
+        weights = [w[valid] for w in weights]
+    counts = np.bincount(ptr, minlength=num)
+    # ``np.sum`` uses pairwise summation which only agrees with the
+    # sequential sums of ``np.bincount`` for cells with at most two entries.
+    # The remaining cells are grouped by their number of entries and the
+    # weights of each group are summed along the rows of a 2D array, which
+    # applies the same pairwise summation to each row, so there is one loop
+    # iteration per distinct number of entries rather than per cell.
+    long_cells = np.nonzero(counts > 2)[0] if len(weights) > 0 else []
+    groups = []
+    if len(long_cells) > 0:
+        order = np.argsort(ptr, kind='mergesort')
+        starts = np.cumsum(counts) - counts
+        long_counts = counts[long_cells]
+        for length in np.unique(long_counts):
+            cells = long_cells[long_counts == length]
+            groups.append((cells, order[starts[cells][:, np.newaxis] +
+                                        np.arange(length)]))
+    sums = []
+    for w in weights:
+        w_sum = np.bincount(ptr, weights=w, minlength=num)
+        for (cells, entries) in groups:
+            w_sum[cells] = np.sum(w[entries], axis=1)
+        sums.append(w_sum)
+    if globalize:
+        local = np.vstack([counts.astype(np.float64)] + sums)
+        total = np.copy(local)
+        comm.Allreduce([local, MPI.DOUBLE], [total, MPI.DOUBLE], op=MPI.SUM)
+        counts = total[0].astype(np.int64)
+        sums = [total[j + 1] for j in range(len(sums))]
+    return (counts, sums)
+
+
+def cell_maxima(ptr, num, values, globalize=True):
+    """
+    Finds the maximum of ``values`` over the entries of ``ptr`` equal to each
+    cell index ``0, ..., num-1``. Entries of ``ptr`` outside of ``[0, num)``
+    are ignored and cells without entries have a maximum of zero, so
+    ``values`` are assumed to be non-negative (e.g. distances).
+
+    If ``globalize`` the maxima are taken over all processors with a single
+    :meth:`~mpi4py.MPI.Comm.Allreduce`.
+
+    :param ptr: cell pointers
+    :type ptr: :class:`~numpy.ndarray` of shape (N,)
+    :param int num: number of cells
+    :param values: non-negative values
+    :type values: :class:`~numpy.ndarray` of shape (N,)
+    :param bool globalize: take the maxima over all processors
+    :rtype: :class:`~numpy.ndarray` of shape (num,)
+    :returns: maxima
+    """
+    ptr = np.ravel(ptr).astype(np.int64)
+    values = np.ravel(values)
+    valid = np.logical_and(np.greater_equal(ptr, 0), np.less(ptr, num))
+    if not np.all(valid):
+        ptr = ptr[valid]
+        values = values[valid]
+    maxima = np.zeros((num,))
+    if len(ptr) > 0:
+        order = np.argsort(ptr, kind='mergesort')
+        (cells, starts) = np.unique(ptr[order], return_index=True)
+        maxima[cells] = np.maximum.reduceat(values[order], starts)
+    if globalize:
+        cmaxima = np.copy(maxima)
+        comm.Allreduce([maxima, MPI.DOUBLE], [cmaxima, MPI.DOUBLE],
+                       op=MPI.MAX)
+        maxima = cmaxima
+    return maxima
+
+
 def fix_dimensions_vector(vector):
     """
     Fix the dimensions of an input so that it is a :class:`numpy.ndarray` of
@@ -3,12 +3,17 @@
 import unittest
 import os
 import glob
+import shutil
+import tempfile
 import numpy as np
 import numpy.testing as nptest
+import scipy.spatial as spatial
 import bet
 import bet.sample as sample
 import bet.util as util
+import bet.spatialIndex as sindex
 import bet.sampling.basicSampling as bsam
+import bet.calculateP.calculateP as calcP
 from bet.Comm import comm, MPI
 
 #local_path = os.path.join(os.path.dirname(bet.__file__), "/test")
@@ -34,6 +39,60 @@ class Test_sample_set(unittest.TestCase):
         nptest.assert_array_equal(self.sam_set._values,
                                   merge_set._values[0:self.num, :])
 
+    def test_merge_many(self):
+        """
+        Test merging many sample sets, from global and from local arrays.
+        """
+        self.sam_set.set_domain(self.domain)
+        sets = []
+        for i in range(3):
+            sset = sample.sample_set(self.dim)
+            sset.set_values(np.random.random((10 + i, self.dim)))
+            sset.set_probabilities(np.random.random((10 + i,)))
+            sset.set_jacobians(np.random.random((10 + i, 3, self.dim)))
+            sets.append(sset)
+        sets[2].set_volumes(np.ones((12,)))
+        self.sam_set.set_probabilities(np.ones((self.num,)) / self.num)
+        self.sam_set.set_jacobians(np.ones((self.num, 3, self.dim)))
+        self.sam_set.set_p_norm(1)
+        self.sam_set.set_kdtree()
+        merge_set = self.sam_set.merge_many(sets)
+        all_sets = [self.sam_set] + sets
+        nptest.assert_array_equal(merge_set._domain, self.domain)
+        for array_name in ['_values', '_probabilities', '_jacobians']:
+            nptest.assert_array_equal(getattr(merge_set, array_name),
+                                      np.concatenate([getattr(sset, array_name)
+                                                      for sset in all_sets]))
+        self.assertIsNone(merge_set._volumes)
+        self.assertEqual(merge_set.check_num(), self.num + 33)
+        self.assertEqual(merge_set.check_num_local(),
+                         merge_set._values_local.shape[0])
+        self.assertEqual(merge_set.get_p_norm(), 1)
+        self.assertIs(merge_set._kdtree, self.sam_set._kdtree)
+        (_, ptr) = merge_set.query(sets[1]._values)
+        nptest.assert_array_equal(ptr, self.num + 10 + np.arange(11))
+
+        local_sets = []
+        for sset in sets:
+            local_set = sample.sample_set(self.dim)
+            local_set.set_values_local(sset._values)
+            local_sets.append(local_set)
+        merge_set = local_sets[0].merge_many(local_sets[1:])
+        nptest.assert_array_equal(merge_set._values_local, np.concatenate(
+            [sset._values for sset in sets]))
+        self.assertEqual(merge_set.check_num(), 33 * comm.size)
+
+        with self.assertRaises(sample.dim_not_matching):
+            self.sam_set.merge_many([sample.sample_set(self.dim + 1)])
+        other_set = self.sam_set.copy()
+        other_set.set_domain(2.0 * self.domain)
+        with self.assertRaises(sample.domain_not_matching):
+            self.sam_set.merge_many(sets + [other_set])
+        other_set = sets[0].copy()
+        other_set.set_jacobians(np.ones((10, 2, self.dim)))
+        with self.assertRaises(sample.dim_not_matching):
+            self.sam_set.merge_many([other_set])
+
     def test_normalize(self):
         """
         Test normalize and undo normalize domain.
@@ -169,6 +228,156 @@ class Test_sample_set(unittest.TestCase):
         elif not globalize:
             os.remove(local_file_name)
 
+    def test_save_load_chunked(self):
+        """
+        Check save_sample_set, load_sample_set, and append_sample_set with
+        the chunked file format.
+        """
+        prob = 1.0 / float(self.num) * np.ones((self.num,))
+        self.sam_set.set_probabilities(prob)
+        jac = np.ones((self.num, 3, self.dim))
+        self.sam_set.set_jacobians(jac)
+        self.sam_set.set_domain(self.domain)
+        self.sam_set.global_to_local()
+        work_dir = tempfile.mkdtemp() if comm.rank == 0 else None
+        work_dir = comm.bcast(work_dir)
+        file_name = os.path.join(work_dir, 'testfile.bet')
+        sample.save_sample_set(self.sam_set, file_name, "TEST", True,
+                               compress=True)
+        sample.save_sample_set(self.sam_set, file_name, "OTHER", True)
+        comm.barrier()
+
+        for mmap_mode in [None, 'r']:
+            loaded_set = sample.load_sample_set(file_name, "TEST",
+                                                mmap_mode=mmap_mode)
+            self.assertIsNone(sample.load_sample_set(file_name))
+            for attrname in sample.sample_set.vector_names + sample.\
+                    sample_set.all_ndarray_names:
+                curr_attr = getattr(self.sam_set, attrname)
+                if curr_attr is not None:
+                    nptest.assert_array_equal(getattr(loaded_set, attrname),
+                                              curr_attr)
+        self.assertIsInstance(sample.load_sample_set(
+            file_name, "OTHER", mmap_mode='r')._values, np.memmap)
+
+        sample.append_sample_set(self.sam_set, file_name, "OTHER")
+        loaded_set = sample.load_sample_set(file_name, "OTHER")
+        nptest.assert_array_equal(loaded_set._values,
+                                  np.concatenate([self.values, self.values]))
+        nptest.assert_array_equal(loaded_set._jacobians,
+                                  np.concatenate([jac, jac]))
+        self.assertEqual(loaded_set.check_num(), 2 * self.num)
+        self.sam_set._probabilities = None
+        self.sam_set._probabilities_local = None
+        with self.assertRaises(sample.length_not_matching):
+            sample.append_sample_set(self.sam_set, file_name, "OTHER")
+        comm.barrier()
+        if comm.rank == 0:
+            shutil.rmtree(work_dir)
+
+    def test_load_parallel(self):
+        """
+        Check that load_sample_set redistributes sample sets saved by a
+        different number of processors.
+        """
+        values = np.random.random((self.num, self.dim))
+        prob = np.random.random((self.num,))
+        work_dir = tempfile.mkdtemp() if comm.rank == 0 else None
+        work_dir = comm.bcast(work_dir)
+        for base_name in ['testfile.mat', 'testfile.bet']:
+            file_name = os.path.join(work_dir, base_name)
+            if comm.rank == 0:
+                for rank, rows in enumerate(np.array_split(
+                        np.arange(self.num), comm.size + 2)):
+                    part = sample.sample_set(self.dim)
+                    part.set_domain(self.domain)
+                    part._values_local = values[rows]
+                    part._probabilities_local = prob[rows]
+                    sample.save_sample_set(part, os.path.join(
+                        work_dir, "proc{}_{}".format(rank, base_name)),
+                        "TEST")
+            comm.barrier()
+            loaded_set = sample.load_sample_set(file_name, "TEST")
+            self.assertIsNone(sample.load_sample_set(file_name))
+            local_index = loaded_set._local_index
+            self.assertEqual(loaded_set.check_num(), self.num)
+            nptest.assert_array_equal(loaded_set._values_local,
+                                      values[local_index])
+            nptest.assert_array_equal(loaded_set._probabilities_local,
+                                      prob[local_index])
+            nptest.assert_array_equal(loaded_set._domain, self.domain)
+            nptest.assert_array_equal(loaded_set._values, values)
+            nptest.assert_array_equal(loaded_set._probabilities, prob)
+            loaded_set = sample.load_sample_set_parallel(file_name, "TEST",
+                                                         globalize=False)
+            nptest.assert_array_equal(loaded_set._values_local,
+                                      values[local_index])
+            self.assertIsNone(loaded_set._values)
+        comm.barrier()
+        if comm.rank == 0:
+            shutil.rmtree(work_dir)
+
+    def test_load_selected_lazy(self):
+        """
+        Check loading selected attributes, lazy loading, and reusing a saved
+        spatial index.
+        """
+        values = np.random.random((self.num, self.dim))
+        prob = 1.0 / float(self.num) * np.ones((self.num,))
+        jac = np.random.random((self.num, 3, self.dim))
+        self.sam_set.set_values(values)
+        self.sam_set.set_probabilities(prob)
+        self.sam_set.set_jacobians(jac)
+        self.sam_set.set_domain(self.domain)
+        (_, ptr) = self.sam_set.query(values[::-1])
+        work_dir = tempfile.mkdtemp() if comm.rank == 0 else None
+        work_dir = comm.bcast(work_dir)
+        for base_name in ['testfile.mat', 'testfile.bet']:
+            file_name = os.path.join(work_dir, base_name)
+            sample.save_sample_set(self.sam_set, file_name, "TEST", True,
+                                   save_index=True)
+            comm.barrier()
+
+            loaded_set = sample.load_sample_set(
+                file_name, "TEST", attributes=['_values', '_probabilities'])
+            self.assertIsNone(loaded_set._jacobians)
+            self.assertIsNone(loaded_set._jacobians_local)
+            self.assertIsNone(loaded_set._kdtree)
+            nptest.assert_array_equal(loaded_set._values, values)
+            nptest.assert_array_equal(loaded_set._probabilities, prob)
+            nptest.assert_array_equal(loaded_set._domain, self.domain)
+
+            loaded_set = sample.load_sample_set(file_name, "TEST", lazy=True,
+                                                load_index=True)
+            self.assertIn('_jacobians', loaded_set._pending_load)
+            self.assertEqual(loaded_set.check_num(), self.num)
+            self.assertEqual(loaded_set.check_num_local(),
+                             loaded_set._local_index.shape[0])
+            copied_set = loaded_set.copy()
+            self.assertIn('_jacobians', loaded_set._pending_load)
+            self.assertIn('_jacobians', copied_set._pending_load)
+            nptest.assert_array_equal(loaded_set._jacobians_local,
+                                      jac[loaded_set._local_index])
+            self.assertIn('_jacobians', loaded_set._pending_load)
+            nptest.assert_array_equal(loaded_set._jacobians, jac)
+            self.assertNotIn('_jacobians', loaded_set._pending_load)
+            nptest.assert_array_equal(copied_set._jacobians, jac)
+            nptest.assert_array_equal(loaded_set._probabilities, prob)
+
+            index = loaded_set._kdtree
+            self.assertIsNotNone(index)
+            nptest.assert_array_equal(loaded_set.query(values[::-1])[1], ptr)
+            self.assertIs(loaded_set._kdtree, index)
+            comm.barrier()
+            if comm.rank == 0:
+                if os.path.isdir(file_name):
+                    shutil.rmtree(file_name)
+                else:
+                    os.remove(file_name)
+        comm.barrier()
+        if comm.rank == 0:
+            shutil.rmtree(work_dir)
+
     def test_copy(self):
         """
         Check copy.
@@ -197,6 +406,80 @@ class Test_sample_set(unittest.TestCase):
 
         assert copied_set._kdtree is not None
 
+    def test_precision(self):
+        """
+        Check set_precision, and that copy, save_sample_set, and
+        load_sample_set keep the precision policy.
+        """
+        self.sam_set.set_probabilities(np.ones((self.num,)) / self.num)
+        self.sam_set.set_precision()
+        self.assertEqual(self.sam_set._values.dtype, np.float32)
+        self.assertEqual(self.sam_set._probabilities.dtype, np.float32)
+        self.sam_set.set_volumes(np.ones((self.num,)))
+        self.assertEqual(self.sam_set._volumes.dtype, np.float32)
+        self.sam_set.global_to_local()
+        self.assertEqual(self.sam_set._values_local.dtype, np.float32)
+        (_, ptr) = self.sam_set.query(self.values[0:5])
+        self.assertEqual(ptr.dtype, np.int32)
+        self.assertEqual(self.sam_set.copy().get_float_dtype(), np.float32)
+        with self.assertRaises(TypeError):
+            self.sam_set.set_precision(np.int32)
+
+        work_dir = tempfile.mkdtemp() if comm.rank == 0 else None
+        work_dir = comm.bcast(work_dir)
+        for file_name in ['testfile.mat', 'testfile.bet']:
+            file_name = os.path.join(work_dir, file_name)
+            sample.save_sample_set(self.sam_set, file_name, "TEST", True)
+            comm.barrier()
+            loaded_set = sample.load_sample_set(file_name, "TEST")
+            self.assertEqual(loaded_set.get_float_dtype(), np.float32)
+            self.assertTrue(loaded_set._compact_pointers)
+            self.assertEqual(loaded_set._values.dtype, np.float32)
+            nptest.assert_array_equal(loaded_set._volumes,
+                                      self.sam_set._volumes)
+        self.sam_set.set_precision(None, False)
+        (_, ptr) = self.sam_set.query(self.values[0:5])
+        self.assertEqual(ptr.dtype, np.int64)
+        sample.save_sample_set(self.sam_set, file_name, "TEST", True)
+        comm.barrier()
+        self.assertIsNone(sample.load_sample_set(file_name,
+                                                 "TEST")._float_dtype)
+        comm.barrier()
+        if comm.rank == 0:
+            shutil.rmtree(work_dir)
+
+    def test_copy_on_write(self):
+        """
+        Check copies share arrays until one of the sample sets writes them.
+        """
+        self.sam_set.set_probabilities(np.ones((self.num,)))
+        self.sam_set.set_kdtree()
+        values = np.copy(self.sam_set.get_values())
+        probabilities = self.sam_set.__dict__['_probabilities']
+        copied_set = self.sam_set.copy()
+        self.assertTrue(np.shares_memory(copied_set._values,
+                                         self.sam_set.__dict__['_values']))
+        self.assertIs(copied_set._kdtree_values, copied_set._values)
+        self.assertIs(copied_set.get_kdtree(), self.sam_set.get_kdtree())
+        self.assertRaises(ValueError, copied_set._probabilities.fill, 0.0)
+
+        # the original detaches its own arrays when it accesses them
+        self.sam_set._values[0, 0] = 5.0
+        nptest.assert_array_equal(copied_set._values, values)
+        self.assertIs(self.sam_set._kdtree_values, self.sam_set._values)
+        self.sam_set._values[0, 0] = values[0, 0]
+        copied_set.set_probabilities(np.zeros((self.num,)))
+        self.assertIs(self.sam_set._probabilities, probabilities)
+        nptest.assert_array_equal(self.sam_set._probabilities, 1.0)
+        self.sam_set.append_values(np.zeros((3, self.dim)))
+        self.sam_set.append_values(np.zeros((3, self.dim)))
+        nptest.assert_array_equal(copied_set._values, values)
+        self.assertEqual(self.sam_set._values.shape[0], self.num + 6)
+
+        # copies of copies share the same arrays
+        copied_set2 = copied_set.copy()
+        self.assertIs(copied_set2._values, copied_set._values)
+
     def test_update_bounds(self):
         """
         Check update_bounds
@@ -301,6 +584,28 @@ class Test_sample_set(unittest.TestCase):
         nptest.assert_array_equal(util.fix_dimensions_data(new_values),
                                   self.sam_set.get_values_local()[local_size::, :])
 
+    def test_append_values_repeated(self):
+        """
+        Check that repeated appends keep earlier views and reassigned values
+        intact.
+        """
+        values = util.fix_dimensions_data(self.values, self.dim)
+        batches = [np.random.random((3, self.dim)) for _ in range(20)]
+        old_values = self.sam_set.get_values()
+        for batch in batches:
+            self.sam_set.append_values(batch)
+        nptest.assert_array_equal(old_values, values)
+        nptest.assert_array_equal(self.sam_set.get_values(),
+                                  np.concatenate([values] + batches))
+
+        # a reassigned prefix must not share memory with the appended rows
+        middle = self.sam_set.get_values()
+        self.sam_set.set_values(middle[:self.num])
+        self.sam_set.append_values(np.ones((2, self.dim)))
+        nptest.assert_array_equal(middle, np.concatenate([values] + batches))
+        nptest.assert_array_equal(self.sam_set.get_values()[self.num:],
+                                  np.ones((2, self.dim)))
+
     def test_get_dim(self):
         """
         Check to see if dimensions are correct.
@@ -454,6 +759,61 @@ class Test_sample_set(unittest.TestCase):
                                           getattr(self.sam_set, array_name +
                                                   "_old"))
 
+    def test_lazy_local(self):
+        """
+        Check local arrays are made when read and only for the given names.
+        """
+        prob = np.random.random((self.num,))
+        self.sam_set.set_probabilities(prob)
+        self.sam_set.global_to_local(['_probabilities'])
+        self.assertIsNone(self.sam_set._values_local)
+        self.assertIn('_probabilities_local', self.sam_set._pending_local)
+        local_index = self.sam_set._local_index
+        nptest.assert_array_equal(self.sam_set._probabilities_local,
+                                  prob[local_index])
+        self.assertNotIn('_probabilities_local', self.sam_set._pending_local)
+        if comm.size == 1:
+            self.assertIs(self.sam_set._probabilities_local, prob)
+
+        # setting a local array before it is read replaces it
+        self.sam_set.global_to_local()
+        self.sam_set.set_probabilities_local(np.zeros(local_index.shape))
+        self.sam_set.set_probabilities(prob)
+        nptest.assert_array_equal(self.sam_set._probabilities_local, 0.0)
+        nptest.assert_array_equal(self.sam_set._values_local,
+                                  util.fix_dimensions_data(
+                                      self.values, self.dim)[local_index])
+
+        # only the given global arrays are made
+        values = self.sam_set._values
+        self.sam_set.local_to_global(['_probabilities'])
+        nptest.assert_array_equal(self.sam_set._probabilities, 0.0)
+        self.assertIs(self.sam_set._values, values)
+
+    def test_check_num_cache(self):
+        """
+        Check the cached number of samples is updated when arrays change.
+        """
+        version = self.sam_set._version
+        self.assertEqual(self.sam_set.check_num(), self.num)
+        self.assertEqual(self.sam_set._check_num_cache[0], version)
+        self.sam_set.set_volumes(np.ones((self.num,)))
+        self.assertGreater(self.sam_set._version, version)
+        self.assertEqual(self.sam_set.check_num(), self.num)
+        self.sam_set._probabilities = np.ones((self.num + 1,))
+        self.assertRaises(sample.length_not_matching, self.sam_set.check_num)
+        self.sam_set.append_values(np.ones((1, self.dim)))
+        self.sam_set.set_volumes(np.ones((self.num + 1,)))
+        self.assertEqual(self.sam_set.check_num(), self.num + 1)
+
+        local_set = sample.sample_set(self.dim)
+        local_set.set_values_local(np.ones((5, self.dim)))
+        self.assertEqual(local_set.check_num_local(), 5)
+        self.assertEqual(local_set.check_num(), 5 * comm.size)
+        local_set.append_values_local(np.ones((2, self.dim)))
+        self.assertEqual(local_set.check_num_local(), 7)
+        self.assertEqual(local_set.check_num(), 7 * comm.size)
+
     def test_domain(self):
         """
         Test domain information.
@@ -539,6 +899,58 @@ class Test_discretization_simple(unittest.TestCase):
         self.disc.get_io_ptr()
         self.disc.globalize_ptrs()
 
+    def test_merge_many(self):
+        """
+        Test merging many discretizations with their pointers.
+        """
+        discs = [self.disc]
+        for i in range(3):
+            input_set = sample.sample_set(dim=self.dim1)
+            output_set = sample.sample_set(dim=self.dim2)
+            input_set.set_values(np.random.random((5 + i, self.dim1)))
+            output_set.set_values(np.random.random((5 + i, self.dim2)))
+            discs.append(sample.discretization(
+                input_set, output_set, self.output_probability_set))
+        for disc in discs:
+            disc.set_io_ptr()
+        merged = discs[0].merge_many(discs[1:])
+        self.assertEqual(merged.check_nums(), self.num + 18)
+        self.assertIs(merged._output_probability_set,
+                      self.output_probability_set)
+        self.assertIsNone(merged._emulated_input_sample_set)
+        nptest.assert_array_equal(merged._input_sample_set._values,
+                                  np.concatenate([disc._input_sample_set.
+                                                  _values for disc in discs]))
+        nptest.assert_array_equal(merged._io_ptr, np.concatenate(
+            [disc._io_ptr for disc in discs]))
+        io_ptr = np.copy(merged._io_ptr)
+        merged._io_ptr_local = None
+        merged.set_io_ptr()
+        nptest.assert_array_equal(merged._io_ptr, io_ptr)
+        merged = discs[0].merge(discs[1])
+        self.assertEqual(merged.check_nums(), self.num + 5)
+
+    def test_set_precision(self):
+        """
+        Test the precision policy of a discretization.
+        """
+        self.disc.set_io_ptr(globalize=True)
+        self.disc.set_precision()
+        for s_set in [self.input_set, self.output_set,
+                      self.output_probability_set]:
+            self.assertEqual(s_set._values.dtype, np.float32)
+        self.assertEqual(self.disc._io_ptr.dtype, np.int32)
+        self.disc.set_io_ptr(globalize=True)
+        self.assertEqual(self.disc._io_ptr_local.dtype, np.int32)
+        prob = np.zeros((self.num,))
+        prob[0] = 1.0
+        self.output_probability_set.set_probabilities(prob)
+        self.input_set.set_volumes(np.ones((self.num,)) / self.num)
+        calcP.prob(self.disc)
+        self.assertEqual(self.input_set._probabilities.dtype, np.float32)
+        nptest.assert_almost_equal(np.sum(self.input_set._probabilities),
+                                   1.0, 5)
+
     def test_set_emulated_ii_ptr(self):
         """
         Test setting emulated ii ptr
@@ -706,6 +1118,97 @@ class Test_discretization_simple(unittest.TestCase):
         elif not globalize:
             os.remove(local_file_name)
 
+    def test_save_load_discretization_chunked(self):
+        """
+        Test saving and loading of discretization with the chunked file
+        format.
+        """
+        work_dir = tempfile.mkdtemp() if comm.rank == 0 else None
+        work_dir = comm.bcast(work_dir)
+        file_name = os.path.join(work_dir, 'testfile')
+        sample.save_discretization(self.disc, file_name, "TEST", True,
+                                   file_format='bet')
+        comm.barrier()
+        self.assertTrue(bet.storage.is_chunked_file(file_name))
+        loaded_disc = sample.load_discretization(file_name, "TEST",
+                                                 mmap_mode='r')
+
+        for attrname in sample.discretization.vector_names:
+            curr_attr = getattr(self.disc, attrname)
+            if curr_attr is not None:
+                nptest.assert_array_equal(getattr(loaded_disc, attrname),
+                                          curr_attr)
+
+        for attrname in sample.discretization.sample_set_names:
+            curr_set = getattr(self.disc, attrname)
+            if curr_set is not None:
+                loaded_set = getattr(loaded_disc, attrname)
+                for set_attrname in sample.sample_set.vector_names +\
+                        sample.sample_set.all_ndarray_names:
+                    curr_attr = getattr(curr_set, set_attrname)
+                    if curr_attr is not None:
+                        nptest.assert_array_equal(getattr(loaded_set,
+                                                          set_attrname),
+                                                  curr_attr)
+        comm.barrier()
+        if comm.rank == 0:
+            shutil.rmtree(work_dir)
+
+    def test_load_discretization_parallel(self):
+        """
+        Test loading of a discretization saved by a different number of
+        processors.
+        """
+        values1 = np.random.random((self.num, self.dim1))
+        values2 = np.random.random((self.num, self.dim2))
+        self.output_probability_set.set_values(np.array([[0.25], [0.75]]))
+        work_dir = tempfile.mkdtemp() if comm.rank == 0 else None
+        work_dir = comm.bcast(work_dir)
+        file_name = os.path.join(work_dir, 'testfile.mat')
+        if comm.rank == 0:
+            for rank, rows in enumerate(np.array_split(np.arange(self.num),
+                                                       comm.size + 2)):
+                input_set = sample.sample_set(self.dim1)
+                input_set._values_local = values1[rows]
+                output_set = sample.sample_set(self.dim2)
+                output_set._values_local = values2[rows]
+                disc = sample.discretization(input_set, output_set,
+                                             self.output_probability_set)
+                disc.set_io_ptr(globalize=False)
+                sample.save_discretization(disc, os.path.join(
+                    work_dir, "proc{}_testfile.mat".format(rank)), "TEST")
+        comm.barrier()
+        loaded_disc = sample.load_discretization(file_name, "TEST")
+        local_index = loaded_disc._input_sample_set._local_index
+        nptest.assert_array_equal(loaded_disc._input_sample_set._values_local,
+                                  values1[local_index])
+        nptest.assert_array_equal(loaded_disc._output_sample_set.
+                                  _values_local, values2[local_index])
+        nptest.assert_array_equal(loaded_disc._io_ptr_local,
+                                  np.greater(values2[local_index, 0], 0.5))
+        loaded_disc._output_probability_set.local_to_global()
+        nptest.assert_array_equal(loaded_disc._output_probability_set.
+                                  _values, self.output_probability_set._values)
+        comm.barrier()
+        if comm.rank == 0:
+            shutil.rmtree(work_dir)
+
+    def test_copy_on_write(self):
+        """
+        Check copies of discretizations share pointers until they are set.
+        """
+        self.disc.set_io_ptr()
+        io_ptr = np.copy(self.disc._io_ptr_local)
+        copied_disc = self.disc.copy()
+        self.assertTrue(np.shares_memory(copied_disc._io_ptr_local,
+                                         self.disc.__dict__['_io_ptr_local']))
+        self.assertRaises(ValueError, copied_disc._io_ptr_local.fill, 0)
+        self.disc._io_ptr_local[:] = 0
+        nptest.assert_array_equal(copied_disc._io_ptr_local, io_ptr)
+        self.assertTrue(np.shares_memory(
+            copied_disc._input_sample_set._values,
+            self.disc._input_sample_set.__dict__['_values']))
+
     def test_copy_discretization(self):
         """
         Test copying of discretization
@@ -875,6 +1378,63 @@ class TestEstimateVolume(unittest.TestCase):
         nptest.assert_array_almost_equal(self.lam_vol, self.volume_exact, 1)
         nptest.assert_almost_equal(np.sum(self.lam_vol), 1.0)
 
+    def test_chunks(self):
+        """
+        Check that streaming the MC points in chunks gives the same volumes.
+        """
+        np.random.seed(1)
+        (n_used, std_error) = self.s_set.estimate_volume(n_mc_points=1001)
+        lam_vol = np.copy(self.s_set._volumes)
+        np.random.seed(1)
+        (n_used_chunks, std_error_chunks) = self.s_set.estimate_volume(
+            n_mc_points=1001, chunk_size=100)
+        self.assertEqual(n_used, 1001)
+        self.assertEqual(n_used_chunks, 1001)
+        nptest.assert_array_equal(self.s_set._volumes, lam_vol)
+        nptest.assert_array_equal(std_error_chunks, std_error)
+        nptest.assert_array_almost_equal(std_error, np.sqrt(
+            lam_vol * (1.0 - lam_vol) / 1001.0))
+
+    def test_rtol(self):
+        """
+        Check that the estimation stops once the relative standard errors are
+        below the tolerance.
+        """
+        (n_used, std_error) = self.s_set.estimate_volume(
+            n_mc_points=int(1E6), chunk_size=1000, rtol=0.1)
+        self.assertLess(n_used, int(1E6))
+        self.assertTrue(np.all(std_error <= 0.1 * self.s_set._volumes))
+        nptest.assert_array_almost_equal(self.s_set._volumes,
+                                         self.volume_exact, 1)
+
+    def test_rtol_empty_cells(self):
+        """
+        Check that the estimation does not stop while a cell has no MC
+        points.
+        """
+        s_set = sample.sample_set(1)
+        s_set.set_domain(np.array([[0.0, 1.0]]))
+        s_set.set_values(np.array([[0.1], [0.5], [0.50001], [0.50002],
+                                   [0.9]]))
+        np.random.seed(1)
+        (n_used, _) = s_set.estimate_volume(n_mc_points=20000,
+                                            chunk_size=1000, rtol=0.5)
+        self.assertEqual(n_used, 20000)
+        (n_used, _) = s_set.estimate_volume(n_mc_points=int(1E6),
+                                            chunk_size=1000, rtol=0.5,
+                                            min_count=2)
+        self.assertLess(n_used, int(1E6))
+        self.assertTrue(np.all(s_set._volumes > 0))
+
+    def test_max_time(self):
+        """
+        Check that the estimation stops once the time budget is used.
+        """
+        (n_used, _) = self.s_set.estimate_volume(
+            n_mc_points=int(1E6), chunk_size=500, max_time=0.0)
+        self.assertEqual(n_used, 500 * comm.size)
+        nptest.assert_almost_equal(np.sum(self.s_set._volumes), 1.0)
+
 
 class TestEstimateVolumeEmulated(unittest.TestCase):
     """
@@ -932,6 +1492,273 @@ class TestEstimateVolumeEmulated(unittest.TestCase):
         nptest.assert_almost_equal(np.sum(self.lam_vol), 1.0)
 
 
+class TestMemmap(unittest.TestCase):
+    """
+    Test memory mapped sample sets and the chunked methods that use them.
+    """
+
+    def setUp(self):
+        """
+        Set up a discretization with emulated samples.
+        """
+        np.random.seed(3)
+        self.work_dir = tempfile.mkdtemp()
+        self.input_set = sample.sample_set(2)
+        self.input_set.set_domain(np.array([[0.0, 1.0], [0.0, 1.0]]))
+        self.input_set.set_values(np.random.random((20, 2)))
+        output_set = sample.sample_set(1)
+        output_set.set_values(np.sum(self.input_set._values, axis=1))
+        output_probability_set = sample.sample_set(1)
+        output_probability_set.set_values(np.array([[0.5], [1.0], [1.5]]))
+        output_probability_set.set_probabilities(np.array([0.2, 0.5, 0.3]))
+        self.emulated_set = sample.sample_set(2)
+        self.emulated_set.set_domain(self.input_set._domain)
+        self.emulated_set.set_values_local(np.random.random((301, 2)))
+        self.disc = sample.discretization(self.input_set, output_set,
+                                          output_probability_set,
+                                          self.emulated_set)
+
+    def tearDown(self):
+        """
+        Remove the working directory.
+        """
+        shutil.rmtree(self.work_dir)
+
+    def test_set_memmap(self):
+        """
+        Check that :meth:`bet.sample.sample_set_base.set_memmap` moves the
+        arrays to files without changing them.
+        """
+        values = np.copy(self.input_set._values)
+        self.input_set.set_memmap(self.work_dir, chunk_size=7)
+        self.assertIsInstance(self.input_set._values, np.memmap)
+        self.assertNotIsInstance(self.input_set._domain, np.memmap)
+        self.assertEqual(self.input_set.get_chunk_size(), 7)
+        nptest.assert_array_equal(self.input_set._values, values)
+        nptest.assert_array_equal(self.input_set.query(values)[1],
+                                  np.arange(20))
+        self.assertEqual(self.input_set.copy().get_chunk_size(), 7)
+        new_array = self.input_set.memmap_array('_jacobians', (20, 1, 2))
+        self.assertIs(self.input_set._jacobians, new_array)
+        self.assertIsInstance(new_array, np.memmap)
+        self.assertEqual(len(glob.glob(os.path.join(self.work_dir, '*.npy'))),
+                         2)
+        with self.assertRaises(AttributeError):
+            self.emulated_set.memmap_array('_values', (20, 2))
+
+    def test_query_chunked(self):
+        """
+        Check that :meth:`bet.sample.sample_set_base.query_chunked` matches
+        :meth:`bet.sample.sample_set_base.query`.
+        """
+        x = self.emulated_set._values_local
+        nptest.assert_array_equal(self.input_set.query_chunked(x,
+                                                               chunk_size=13),
+                                  self.input_set.query(x)[1])
+
+    def test_query_iter(self):
+        """
+        Check that :meth:`bet.sample.sample_set_base.query_iter` and
+        :meth:`bet.sample.sample_set_base.query_chunked` locate arrays and
+        generators of chunks like :meth:`bet.sample.sample_set_base.query`.
+        """
+        x = self.emulated_set._values_local
+        (dist, ptr) = self.input_set.query(x, k=2)
+        starts = []
+        for (start, chunk_dist, chunk_ptr) in self.input_set.query_iter(
+                x, k=2, chunk_size=50, return_distances=True):
+            starts.append(start)
+            nptest.assert_array_equal(chunk_ptr, ptr[start:start + 50])
+            nptest.assert_array_equal(chunk_dist, dist[start:start + 50])
+        self.assertEqual(starts, list(range(0, 301, 50)))
+
+        def chunks():
+            for start in range(0, 301, 120):
+                yield x[start:start + 120]
+        for prefetch in [True, False]:
+            (chunked_dist, chunked_ptr) = self.input_set.query_chunked(
+                chunks(), k=2, chunk_size=50, return_distances=True,
+                prefetch=prefetch)
+            nptest.assert_array_equal(chunked_ptr, ptr)
+            nptest.assert_array_equal(chunked_dist, dist)
+        out = np.zeros((301,), dtype=np.int32)
+        self.assertIs(self.input_set.query_chunked(chunks(), out=out), out)
+        nptest.assert_array_equal(out, ptr[:, 0])
+        self.assertEqual(self.input_set.query_chunked(iter([])).shape, (0,))
+        iterator = self.input_set.query_iter(chunks(), chunk_size=10)
+        self.assertEqual(next(iterator)[0], 0)
+        iterator.close()
+        nptest.assert_array_equal(self.input_set.query_chunked(x, k=3,
+                                                               chunk_size=13),
+                                  self.input_set.query(x, k=3)[1])
+
+    def test_emulated(self):
+        """
+        Check that volumes, pointers, and probabilities computed from memory
+        mapped emulated samples in chunks match those computed in memory.
+        """
+        self.input_set.estimate_volume_emulated(self.emulated_set)
+        volumes = np.copy(self.input_set._volumes)
+        calcP.prob_on_emulated_samples(self.disc)
+        ptr = np.copy(self.disc._emulated_ii_ptr_local)
+        prob = np.copy(self.emulated_set._probabilities)
+
+        self.emulated_set.set_memmap(self.work_dir, chunk_size=13)
+        self.disc._emulated_ii_ptr_local = None
+        self.input_set.estimate_volume_emulated(self.emulated_set)
+        calcP.prob_on_emulated_samples(self.disc)
+        self.assertIsInstance(self.disc._emulated_ii_ptr_local, np.memmap)
+        self.assertIsInstance(self.emulated_set._probabilities_local,
+                              np.memmap)
+        nptest.assert_array_almost_equal(self.input_set._volumes, volumes)
+        nptest.assert_array_equal(self.disc._emulated_ii_ptr_local, ptr)
+        nptest.assert_array_almost_equal(self.emulated_set._probabilities,
+                                         prob)
+        nptest.assert_almost_equal(np.sum(prob), 1.0)
+
+        # repeated calls replace the files instead of adding new ones
+        num_files = len(os.listdir(self.work_dir))
+        for _ in range(3):
+            self.disc.set_emulated_ii_ptr(globalize=False)
+            calcP.prob_on_emulated_samples(self.disc)
+        self.assertEqual(len(os.listdir(self.work_dir)), num_files)
+        nptest.assert_array_equal(self.disc._emulated_ii_ptr_local, ptr)
+
+
+class TestPointerCache(unittest.TestCase):
+    """
+    Test :class:`bet.sample.pointer_cache` and its use by
+    :class:`bet.sample.discretization`.
+    """
+
+    def setUp(self):
+        """
+        Set up a discretization and count the queries of the output
+        probability set.
+        """
+        np.random.seed(4)
+        self.work_dir = tempfile.mkdtemp()
+        self.default_cache = sample.default_pointer_cache
+        sample.set_default_pointer_cache(sample.pointer_cache())
+        input_set = sample.sample_set(2)
+        input_set.set_values(np.random.random((50, 2)))
+        output_set = sample.sample_set(1)
+        output_set.set_values(np.sum(input_set._values, axis=1))
+        self.output_probability_set = self.counted_set(
+            np.array([[0.5], [1.0], [1.5]]))
+        self.disc = sample.discretization(input_set, output_set,
+                                          self.output_probability_set)
+
+    def tearDown(self):
+        """
+        Restore the default pointer cache and remove the working directory.
+        """
+        sample.set_default_pointer_cache(self.default_cache)
+        shutil.rmtree(self.work_dir)
+
+    def counted_set(self, values):
+        """
+        Returns a sample set with ``values`` that counts calls of its
+        :meth:`~bet.sample.sample_set_base.query` in ``num_queries``.
+        """
+        s_set = sample.sample_set(values.shape[1])
+        s_set.set_values(values)
+        s_set.num_queries = 0
+        query = s_set.query
+
+        def counted_query(x, k=1):
+            s_set.num_queries += 1
+            return query(x, k)
+        s_set.query = counted_query
+        return s_set
+
+    def test_fingerprint(self):
+        """
+        Check that fingerprints only depend on the cells of a sample set.
+        """
+        s_set = self.output_probability_set
+        fingerprint = s_set.fingerprint()
+        self.assertEqual(s_set.copy().fingerprint(), fingerprint)
+        s_set.set_probabilities(np.array([0.2, 0.5, 0.3]))
+        self.assertEqual(s_set.fingerprint(), fingerprint)
+        s_set.set_p_norm(1)
+        self.assertNotEqual(s_set.fingerprint(), fingerprint)
+        s_set.set_p_norm(2)
+        s_set.set_values(np.array([[0.5], [1.0], [1.6]]))
+        self.assertNotEqual(s_set.fingerprint(), fingerprint)
+        s_set.global_to_local()
+        self.assertNotEqual(s_set.fingerprint(local=True),
+                            s_set.fingerprint())
+        s_set.set_index_backend('rpforest')
+        fingerprint = s_set.fingerprint()
+        n_trees = sindex.rp_forest_trees
+        try:
+            sindex.rp_forest_trees = n_trees + 1
+            self.assertNotEqual(s_set.fingerprint(), fingerprint)
+        finally:
+            sindex.rp_forest_trees = n_trees
+
+    def test_reuse(self):
+        """
+        Check that pointers are reused by copies and by output probability
+        sets with the same cells, and recomputed when the cells change.
+        """
+        self.assertIsNone(self.default_cache)
+        self.disc.set_io_ptr()
+        io_ptr = np.copy(self.disc._io_ptr)
+        self.assertTrue(self.disc._io_ptr.flags.writeable)
+        self.assertEqual(self.output_probability_set.num_queries, 1)
+        disc_copy = self.disc.copy()
+        disc_copy._io_ptr_local = None
+        disc_copy.set_io_ptr()
+        nptest.assert_array_equal(disc_copy._io_ptr, io_ptr)
+        disc_copy._io_ptr_local[:] = 0
+        self.disc.set_io_ptr()
+        nptest.assert_array_equal(self.disc._io_ptr, io_ptr)
+
+        same_set = self.counted_set(np.array([[0.5], [1.0], [1.5]]))
+        same_set.set_probabilities(np.array([0.2, 0.5, 0.3]))
+        self.disc.set_output_probability_set(same_set)
+        nptest.assert_array_equal(self.disc._io_ptr_local, io_ptr)
+        self.assertEqual(same_set.num_queries, 0)
+        self.assertEqual(self.output_probability_set.num_queries, 1)
+
+        same_set.set_values(np.array([[0.0], [3.0], [4.0]]))
+        self.disc.set_io_ptr()
+        self.assertEqual(same_set.num_queries, 1)
+        nptest.assert_array_equal(self.disc._io_ptr, np.greater(
+            self.disc._output_sample_set._values[:, 0], 1.5))
+
+        sample.set_default_pointer_cache(None)
+        self.disc.set_io_ptr()
+        self.assertEqual(same_set.num_queries, 2)
+
+    def test_persistence(self):
+        """
+        Check that pointers saved to disk are reused by a new cache, and
+        that the memory limit is kept.
+        """
+        cache_dir = os.path.join(self.work_dir, 'cache')
+        sample.set_default_pointer_cache(sample.pointer_cache(cache_dir))
+        self.disc.set_io_ptr()
+        sample.set_default_pointer_cache(sample.pointer_cache(cache_dir))
+        disc_copy = self.disc.copy()
+        disc_copy._io_ptr_local = None
+        disc_copy.set_io_ptr()
+        self.assertEqual(self.output_probability_set.num_queries, 1)
+        nptest.assert_array_equal(disc_copy._io_ptr, self.disc._io_ptr)
+
+        cache = sample.pointer_cache(max_bytes=10)
+        cache.put('a', np.arange(2, dtype=np.int32))
+        cache.put('b', np.arange(1, dtype=np.int32))
+        self.assertIsNone(cache.get('a'))
+        nptest.assert_array_equal(cache.get('b'), [0])
+        cache.put('c', np.arange(10))
+        self.assertIsNone(cache.get('c'))
+        sample.default_pointer_cache.clear()
+        self.assertEqual(os.listdir(cache_dir), [])
+
+
 class TestEstimateLocalVolume(unittest.TestCase):
     """
     Test :meth:`bet.calculateP.calculateP.estimate_local_volulme`.
@@ -981,6 +1808,27 @@ class TestEstimateLocalVolume(unittest.TestCase):
         nptest.assert_array_almost_equal(self.lam_vol, self.volume_exact, 2)
         nptest.assert_almost_equal(np.sum(self.lam_vol), 1.0)
 
+    def test_workers(self):
+        """
+        Check the volumes when querying with several threads and stopping
+        after fewer emulated samples.
+        """
+        self.s_set.estimate_local_volume(num_emulate_local=50, workers=2)
+        nptest.assert_array_almost_equal(self.s_set._volumes,
+                                         self.volume_exact, 1)
+        nptest.assert_almost_equal(np.sum(self.s_set._volumes), 1.0)
+
+    def test_zero_radii(self):
+        """
+        Check the volumes when the radii are estimated from the pairwise
+        distances between samples.
+        """
+        self.s_set._normalized_radii = np.zeros((self.s_set.check_num(),))
+        self.s_set.estimate_local_volume()
+        nptest.assert_array_almost_equal(self.s_set._volumes,
+                                         self.volume_exact, 1)
+        nptest.assert_almost_equal(np.sum(self.s_set._volumes), 1.0)
+
 
 class TestExactVolume1D(unittest.TestCase):
     """
@@ -1049,6 +1897,98 @@ class TestExactVolume2D(unittest.TestCase):
         nptest.assert_array_almost_equal(self.vol1, self.vol2)
         nptest.assert_almost_equal(np.sum(self.vol1), 1.0)
 
+    def test_random_volumes(self):
+        """
+        Check the areas of the Voronoi regions of random samples against
+        triangulating each region.
+        """
+        np.random.seed(4)
+        points = np.random.random((50, 2))
+        vor = spatial.Voronoi(points)
+        areas = sample._voronoi_areas_2D(vor, np.arange(50))
+        for i in range(50):
+            region = vor.regions[vor.point_region[i]]
+            if -1 in region:
+                self.assertEqual(areas[i], 0.0)
+            else:
+                hull = spatial.ConvexHull(vor.vertices[region])
+                nptest.assert_almost_equal(areas[i], hull.volume)
+        self.assertGreater(np.sum(areas > 0), 10)
+
+
+class TestExactVolumeND(unittest.TestCase):
+    """
+    Test :meth:`bet.sample.voronoi_sample_set.exact_volume_ND`.
+    """
+
+    def setUp(self):
+        """
+        Set up random samples in a 3D box.
+        """
+        np.random.seed(5)
+        self.input_samples = sample.sample_set(3)
+        self.input_samples.set_domain(np.array([[0.0, 1.0], [-1.0, 1.0],
+                                                [0.0, 2.0]]))
+        self.input_samples.set_values(
+            self.input_samples.get_domain()[:, 0] +
+            np.random.random((30, 3)) * np.array([1.0, 2.0, 2.0]))
+
+    def test_volumes(self):
+        """
+        Check that the volumes sum to one and agree with a MC estimate.
+        """
+        self.input_samples.exact_volume_ND()
+        vol1 = np.copy(self.input_samples._volumes)
+        nptest.assert_almost_equal(np.sum(vol1), 1.0)
+        self.assertTrue(np.all(vol1 > 0))
+        self.input_samples.estimate_volume(n_mc_points=int(2e5))
+        vol2 = self.input_samples._volumes
+        nptest.assert_array_almost_equal(vol1, vol2, decimal=2)
+
+    def test_processes(self):
+        """
+        Check that a process pool gives the same volumes.
+        """
+        self.input_samples.exact_volume_ND()
+        vol1 = np.copy(self.input_samples._volumes)
+        self.input_samples.exact_volume_ND(processes=2)
+        nptest.assert_array_almost_equal(vol1, self.input_samples._volumes)
+
+    def test_degenerate(self):
+        """
+        Check that degenerate cells get a volume of zero and a warning.
+        """
+        flat = np.array([[0.0, 0.0, 0.0], [1.0, 0.0, 0.0], [0.0, 1.0, 0.0],
+                         [1.0, 1.0, 0.0]])
+        cube = np.array([[i, j, k] for i in [0.0, 1.0] for j in [0.0, 1.0]
+                         for k in [0.0, 1.0]])
+        with self.assertLogs(level='WARNING') as logs:
+            volumes = sample._convex_hull_volumes([cube, flat], [3, 7])
+        nptest.assert_array_almost_equal(volumes, [1.0, 0.0])
+        self.assertEqual(len(logs.output), 1)
+        self.assertIn("Cell 7", logs.output[0])
+
+    def test_2D(self):
+        """
+        Check that the volumes match :meth:`exact_volume_2D` in 2D.
+        """
+        s_set = sample.sample_set(2)
+        s_set.set_domain(np.array([[0.0, 1.0], [0.0, 1.0]]))
+        s_set.set_values(np.random.random((40, 2)))
+        s_set.exact_volume_2D()
+        vol1 = np.copy(s_set._volumes)
+        s_set.exact_volume_ND()
+        nptest.assert_array_almost_equal(vol1, s_set._volumes)
+
+    def test_1D(self):
+        """
+        Check that 1D domains are rejected.
+        """
+        s_set = sample.sample_set(1)
+        s_set.set_domain(np.array([[0.0, 1.0]]))
+        s_set.set_values(np.random.random((10, 1)))
+        self.assertRaises(sample.dim_not_matching, s_set.exact_volume_ND)
+
 
 class TestEstimateRadii(unittest.TestCase):
     """
@@ -1104,6 +2044,30 @@ class TestEstimateRadii(unittest.TestCase):
         nptest.assert_array_almost_equal(self.rad, self.radii_exact, 1)
         nptest.assert_array_almost_equal(self.norm_rad, self.radii_exact, 1)
 
+    def test_chunks(self):
+        """
+        Check that streaming the MC points in chunks gives the same radii.
+        """
+        np.random.seed(1)
+        self.s_set.estimate_radii(n_mc_points=1001)
+        norm_rad = np.copy(self.s_set._normalized_radii)
+        np.random.seed(1)
+        self.s_set.estimate_radii(n_mc_points=1001, chunk_size=100)
+        nptest.assert_array_equal(self.s_set._normalized_radii, norm_rad)
+
+    def test_empty_cells(self):
+        """
+        Check that cells without MC points have a radius of zero.
+        """
+        s_set = sample.sample_set(self.s_set.get_dim())
+        s_set.set_domain(self.lam_domain)
+        s_set.set_values(np.vstack([self.s_set._values,
+                                    self.s_set._values[0]]))
+        s_set.estimate_radii(normalize=False)
+        self.assertEqual(s_set._radii[-1], 0.0)
+        nptest.assert_array_almost_equal(s_set._radii[1:-1],
+                                         self.radii_exact, 1)
+
 
 class TestEstimateRadiiAndVolume(unittest.TestCase):
     """
@@ -1165,6 +2129,20 @@ class TestEstimateRadiiAndVolume(unittest.TestCase):
         nptest.assert_array_almost_equal(self.lam_vol, self.volume_exact, 1)
         nptest.assert_almost_equal(np.sum(self.lam_vol), 1.0)
 
+    def test_chunks(self):
+        """
+        Check that streaming the MC points in chunks gives the same radii and
+        volumes.
+        """
+        np.random.seed(1)
+        self.s_set.estimate_radii_and_volume(n_mc_points=1001)
+        norm_rad = np.copy(self.s_set._normalized_radii)
+        lam_vol = np.copy(self.s_set._volumes)
+        np.random.seed(1)
+        self.s_set.estimate_radii_and_volume(n_mc_points=1001, chunk_size=64)
+        nptest.assert_array_equal(self.s_set._normalized_radii, norm_rad)
+        nptest.assert_array_equal(self.s_set._volumes, lam_vol)
+
 
 class Test_rectangle_sample_set(unittest.TestCase):
     def setUp(self):
@@ -1291,6 +2269,19 @@ class Test_rectangle_sample_set(unittest.TestCase):
         (d, ptr) = self.sam_set.query(x)
         nptest.assert_array_equal(ptr, np.arange(self.nprocs - 1))
 
+    def test_query_k(self):
+        """
+        Check querying for more than one neighbor and the remainder.
+        """
+        n = np.linspace(0.1, 0.9, self.nprocs)
+        x = np.array([[n[i] + 1E-5, n[i] + 1E-5]
+                      for i in range(self.nprocs - 1)] + [[0.05, 0.05]])
+        (d, ptr) = self.sam_set.query(x, k=2)
+        nptest.assert_array_equal(ptr[:, 0], np.arange(self.nprocs))
+        nptest.assert_array_equal(ptr[:, 1], self.nprocs - 1)
+        nptest.assert_array_equal(d[:-1, 0], 0.0)
+        nptest.assert_array_equal(d[-1, 0], np.inf)
+
     def test_volumes(self):
         """
         Check volume calculation
@@ -1318,6 +2309,20 @@ class Test_ball_sample_set(unittest.TestCase):
         self.sam_set.set_domain(self.domain)
         self.num = self.sam_set.check_num()
 
+    def test_query_k(self):
+        """
+        Check querying overlapping balls for more than one neighbor and the
+        remainder.
+        """
+        n = np.linspace(0.1, 0.9, self.nprocs)
+        mid = 0.5 * (n[0] + n[1])
+        x = np.array([[n[0], n[0]], [mid, mid], [0.95, 0.05]])
+        (d, ptr) = self.sam_set.query(x, k=2)
+        nptest.assert_array_equal(ptr, [[0, self.nprocs - 1], [0, 1],
+                                        [self.nprocs - 1, self.nprocs - 1]])
+        nptest.assert_array_equal(d, [[0.0, np.inf], [0.0, 0.0],
+                                      [np.inf, np.inf]])
+
     def test_save_load(self):
         """
         Check save_sample_set and load_sample_set.
@@ -1586,3 +2591,93 @@ class Test_cartesian_sample_set(unittest.TestCase):
         volumes = self.sam_set.get_volumes()
         nptest.assert_array_almost_equal(volumes[:-1], 1. / self.nprocs)
         assert volumes[-1] == 0
+
+
+class Test_cartesian_sample_set_implicit(unittest.TestCase):
+    def setUp(self):
+        self.dim = 3
+        self.xi = [np.linspace(0, 1, 4), np.linspace(0, 1, 3),
+                   np.array([0.0, 0.1, 0.5, 0.6, 1.0])]
+        self.sam_set = sample.cartesian_sample_set(dim=self.dim)
+        self.sam_set.setup(self.xi, implicit=True)
+        self.full_set = sample.cartesian_sample_set(dim=self.dim)
+        self.full_set.setup(self.xi)
+        self.domain = np.array([[0, 1], [0, 1], [0, 1]], dtype=np.float)
+        self.sam_set.set_domain(self.domain)
+        self.full_set.set_domain(self.domain)
+        self.num = self.full_set.check_num()
+
+    def test_storage(self):
+        """
+        Check only the grid is stored.
+        """
+        assert self.sam_set.is_implicit()
+        assert not self.full_set.is_implicit()
+        self.assertIsNone(self.sam_set.get_values())
+        self.assertEqual(self.sam_set.check_num(), self.num)
+        for xv, xv_ex in zip(self.sam_set.get_xi(), self.xi):
+            nptest.assert_array_equal(xv, xv_ex)
+
+    def test_check_num(self):
+        """
+        Check arrays must match the number of cells in the grid.
+        """
+        self.sam_set.set_probabilities(np.ones((self.num - 1,)))
+        self.assertRaises(sample.length_not_matching, self.sam_set.check_num)
+
+    def test_query(self):
+        """
+        Check querying matches the pointwise hyperrectangles.
+        """
+        x = np.vstack((np.random.random((200, self.dim)) * 1.2 - 0.1,
+                       self.full_set._right[:-1], self.full_set._left[:-1]))
+        (d, ptr) = self.sam_set.query(x)
+        box_index = sindex.box_index(self.full_set._left[:-1],
+                                               self.full_set._right[:-1])
+        (d_ex, ptr_ex) = box_index.query(x)
+        nptest.assert_array_equal(ptr, ptr_ex)
+        nptest.assert_array_equal(d, d_ex)
+        (d, ptr) = self.full_set.query(x, k=2)
+        nptest.assert_array_equal(ptr[:, 0], ptr_ex)
+        nptest.assert_array_equal(ptr[:, 1], self.num - 1)
+
+    def test_volumes(self):
+        """
+        Check volume calculation matches the pointwise hyperrectangles.
+        """
+        self.sam_set.exact_volume_lebesgue()
+        volumes = self.sam_set.get_volumes()
+        volumes_ex = np.prod(self.full_set._width[:-1], axis=1)
+        nptest.assert_array_almost_equal(volumes[:-1], volumes_ex)
+        nptest.assert_almost_equal(volumes[-1], 0.0)
+
+    def test_normalize(self):
+        """
+        Check the grid is normalized with the domain.
+        """
+        domain = np.array([[0, 1], [0, 2], [-1, 1]], dtype=np.float)
+        self.sam_set.set_domain(domain)
+        self.sam_set.normalize_domain()
+        nptest.assert_array_almost_equal(self.sam_set.get_xi()[2],
+                                         (self.xi[2] + 1.0) / 2.0)
+        self.sam_set.undo_normalize_domain()
+        nptest.assert_array_almost_equal(self.sam_set.get_xi()[2], self.xi[2])
+
+    def test_save_load(self):
+        """
+        Check save_sample_set and load_sample_set.
+        """
+        prob = 1.0 / float(self.num) * np.ones((self.num,))
+        self.sam_set.set_probabilities(prob)
+        file_name = os.path.join(local_path, 'testfile.mat')
+        sample.save_sample_set(self.sam_set, file_name, "TEST", True)
+        comm.barrier()
+        loaded_set = sample.load_sample_set(file_name, "TEST")
+        assert loaded_set.is_implicit()
+        nptest.assert_array_equal(loaded_set.get_probabilities(), prob)
+        x = np.random.random((50, self.dim))
+        nptest.assert_array_equal(loaded_set.query(x)[1],
+                                  self.sam_set.query(x)[1])
+        comm.barrier()
+        if comm.rank == 0:
+            os.remove(file_name)
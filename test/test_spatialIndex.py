@@ -0,0 +1,568 @@
+# Copyright (C) 2014-2019 The BET Development Team
+
+"""
+This module contains unittests for :mod:`~bet.spatialIndex`
+"""
+
+import unittest
+import numpy as np
+import numpy.testing as nptest
+import scipy.spatial as spatial
+import bet.sample as sample
+import bet.spatialIndex as sindex
+
+
+class Test_minkowski(unittest.TestCase):
+    """
+    Test the Minkowski norm kernels against :meth:`numpy.linalg.norm` and
+    :meth:`scipy.spatial.distance.cdist`.
+    """
+
+    def setUp(self):
+        np.random.seed(1)
+        self.x = np.random.random((30, 4)) - 0.5
+        self.y = np.random.random((20, 4)) - 0.5
+
+    def test_norm(self):
+        """
+        Check :meth:`bet.spatialIndex.minkowski_norm` and
+        :meth:`bet.spatialIndex.minkowski_within`.
+        """
+        diff = self.x[:, np.newaxis, :] - self.y
+        radii = np.random.random((30, 20))
+        for p in [1, 1.0, 2, 3.5, np.inf, np.array(np.inf)]:
+            norm = np.linalg.norm(diff, ord=float(p), axis=-1)
+            nptest.assert_array_almost_equal(sindex.minkowski_norm(diff, p),
+                                             norm)
+            nptest.assert_array_equal(sindex.minkowski_within(diff, radii, p),
+                                      norm < radii)
+            boundary = sindex.minkowski_norm(diff, p)
+            self.assertFalse(np.any(sindex.minkowski_within(diff, boundary,
+                                                            p)))
+            self.assertFalse(np.any(sindex.minkowski_within(diff, -radii,
+                                                            p)))
+        self.assertEqual(sindex.minkowski_norm(np.zeros((3, 0)),
+                                               np.inf).shape, (3,))
+
+    def test_distances(self):
+        """
+        Check :meth:`bet.spatialIndex.minkowski_distances`.
+        """
+        for p in [1, 2, 3.5, np.inf]:
+            nptest.assert_array_almost_equal(
+                sindex.minkowski_distances(self.x, self.y, p),
+                np.linalg.norm(self.x[:, np.newaxis, :] - self.y, ord=p,
+                               axis=-1))
+
+
+class compare_kdtree:
+    """
+    Compares the results of a spatial index backend against
+    :class:`scipy.spatial.KDTree`.
+    """
+
+    def createIndex(self):
+        """
+        Create the spatial index with the backend being tested.
+        """
+        self.index = sindex.build_index(self.data, self.backend)
+        self.tree = spatial.KDTree(self.data)
+
+    def compare(self, k, p, distance_upper_bound=np.inf):
+        """
+        Compare a query against :class:`scipy.spatial.KDTree`.
+        """
+        (dist, ptr) = self.index.query(self.x, k=k, p=p,
+                                       distance_upper_bound=distance_upper_bound)
+        (dist_ex, ptr_ex) = self.tree.query(self.x, k=k, p=p,
+                                            distance_upper_bound=distance_upper_bound)
+        self.assertEqual(dist.shape, dist_ex.shape)
+        nptest.assert_array_equal(ptr, ptr_ex)
+        nptest.assert_array_almost_equal(dist, dist_ex)
+
+    def test_data(self):
+        """
+        Check the generating samples are stored.
+        """
+        nptest.assert_array_equal(self.index.data, self.data)
+
+    def test_query(self):
+        """
+        Check nearest neighbor queries.
+        """
+        self.compare(1, 2.0)
+
+    def test_query_k(self):
+        """
+        Check k nearest neighbor queries.
+        """
+        self.compare(3, 2.0)
+
+    def test_query_p_norm(self):
+        """
+        Check queries in other p-norms.
+        """
+        self.compare(1, 1.0)
+        self.compare(2, np.inf)
+        self.compare(1, 3.0)
+
+    def test_query_upper_bound(self):
+        """
+        Check queries with a distance upper bound.
+        """
+        self.compare(2, 2.0, distance_upper_bound=0.05)
+
+    def test_query_single(self):
+        """
+        Check a query for a single point.
+        """
+        (dist, ptr) = self.index.query(self.x[0])
+        (dist_ex, ptr_ex) = self.tree.query(self.x[0])
+        self.assertEqual(ptr, ptr_ex)
+        nptest.assert_almost_equal(dist, dist_ex)
+
+
+class Test_kdtree_index(compare_kdtree, unittest.TestCase):
+    def setUp(self):
+        np.random.seed(1)
+        self.backend = 'kdtree'
+        self.data = np.random.random((50, 2))
+        self.x = np.random.random((200, 2)) * 1.2 - 0.1
+        self.createIndex()
+
+
+class Test_ckdtree_index(compare_kdtree, unittest.TestCase):
+    def setUp(self):
+        np.random.seed(1)
+        self.backend = 'ckdtree'
+        self.data = np.random.random((50, 3))
+        self.x = np.random.random((200, 3)) * 1.2 - 0.1
+        self.createIndex()
+
+
+class Test_brute_index(compare_kdtree, unittest.TestCase):
+    def setUp(self):
+        np.random.seed(1)
+        self.backend = 'brute'
+        self.data = np.random.random((50, 3))
+        self.x = np.random.random((200, 3)) * 1.2 - 0.1
+        self.createIndex()
+
+
+class Test_grid_index(compare_kdtree, unittest.TestCase):
+    def setUp(self):
+        np.random.seed(1)
+        self.backend = 'grid'
+        self.data = np.random.random((100, 2))
+        self.x = np.random.random((300, 2)) * 1.4 - 0.2
+        self.createIndex()
+
+
+class Test_grid_index_1D(compare_kdtree, unittest.TestCase):
+    def setUp(self):
+        np.random.seed(2)
+        self.backend = 'grid'
+        self.data = np.random.random((40, 1))
+        self.x = np.random.random((100, 1)) * 1.4 - 0.2
+        self.createIndex()
+
+
+class Test_rp_forest_index(compare_kdtree, unittest.TestCase):
+    def setUp(self):
+        np.random.seed(1)
+        self.backend = 'rpforest'
+        self.data = np.random.random((50, 3))
+        self.x = np.random.random((200, 3)) * 1.2 - 0.1
+        self.createIndex()
+
+    def createIndex(self):
+        """
+        Create a forest of trees with a single leaf, which is exact and
+        gives every sample twice as a candidate.
+        """
+        self.index = sindex.rp_forest_index(self.data, n_trees=2,
+                                            leaf_size=50)
+        self.tree = spatial.KDTree(self.data)
+
+    def test_approximate(self):
+        """
+        Check that small leaves miss few nearest neighbors in higher
+        dimensions and that the trees have bounded leaves.
+        """
+        data = np.random.random((2000, 12))
+        x = np.random.random((500, 12))
+        index = sindex.build_index(data, 'rpforest')
+        self.assertIsInstance(index, sindex.rp_forest_index)
+        for tree in index._trees:
+            self.assertEqual(tree[4].shape[1], sindex.rp_forest_leaf_size)
+            nptest.assert_array_equal(np.unique(tree[4])[:-1],
+                                      np.arange(2000))
+        (dist, ptr) = index.query(x)
+        (dist_ex, ptr_ex) = spatial.cKDTree(data).query(x)
+        self.assertTrue(np.all(dist >= dist_ex - 1E-12))
+        nptest.assert_array_almost_equal(
+            dist, minkowski_dist(x, data[ptr]))
+        self.assertLess(np.mean(ptr != ptr_ex), 0.5)
+
+
+def minkowski_dist(x, y):
+    """
+    Returns the Euclidean distances between the rows of ``x`` and ``y``.
+    """
+    return np.sqrt(np.sum((x - y)**2, axis=1))
+
+
+class Test_incremental_index(compare_kdtree, unittest.TestCase):
+    def setUp(self):
+        np.random.seed(4)
+        self.backend = 'ckdtree'
+        self.data = np.random.random((90, 2))
+        self.x = np.random.random((200, 2)) * 1.2 - 0.1
+        self.createIndex()
+
+    def createIndex(self):
+        """
+        Create the index over the first rows and extend it in batches.
+        """
+        self.index = sindex.incremental_index(
+            sindex.build_index(self.data[:10], self.backend),
+            self.backend, buffer_size=4)
+        for num in range(12, 91, 3):
+            self.index = self.index.extend(self.data[:num])
+        self.tree = spatial.KDTree(self.data)
+
+    def test_blocks(self):
+        """
+        Check the blocks cover the static rows and the tail is small.
+        """
+        start = 0
+        for (block_start, index) in self.index.blocks:
+            self.assertEqual(block_start, start)
+            start += index.data.shape[0]
+        self.assertEqual(start, self.index.num_static)
+        self.assertLessEqual(self.data.shape[0] - start, 4)
+        self.assertLess(len(self.index.blocks), 7)
+
+    def test_extend_copy(self):
+        """
+        Check extending returns a new index and leaves this one unchanged.
+        """
+        index = self.index.extend(np.vstack((self.data,
+                                             np.random.random((20, 2)))))
+        self.assertEqual(self.index.data.shape[0], 90)
+        self.assertEqual(index.data.shape[0], 110)
+        self.compare(2, 2.0)
+
+
+class Test_sample_set_incremental(unittest.TestCase):
+    """
+    Test keeping the spatial index of a sample set up to date.
+    """
+
+    def setUp(self):
+        np.random.seed(5)
+        self.sam_set = sample.sample_set(2)
+        self.sam_set.set_values(np.random.random((20, 2)))
+        self.x = np.random.random((100, 2))
+        self.sam_set.query(self.x)
+
+    def reference(self):
+        """
+        Returns the pointers from a freshly built index.
+        """
+        return spatial.KDTree(self.sam_set.get_values()).query(self.x)[1]
+
+    def test_append(self):
+        """
+        Check appending values extends the index.
+        """
+        for _ in range(5):
+            self.sam_set.append_values(np.random.random((7, 2)))
+            (_, ptr) = self.sam_set.query(self.x)
+            nptest.assert_array_equal(ptr, self.reference())
+        self.assertIsInstance(self.sam_set.get_kdtree(),
+                              sindex.incremental_index)
+
+    def test_set_values(self):
+        """
+        Check setting new values rebuilds the index.
+        """
+        self.sam_set.set_values(np.random.random((15, 2)))
+        (_, ptr) = self.sam_set.query(self.x)
+        nptest.assert_array_equal(ptr, self.reference())
+
+    def test_copy(self):
+        """
+        Check copies share the index and extend it independently.
+        """
+        copied_set = self.sam_set.copy()
+        self.assertIs(copied_set.get_kdtree(), self.sam_set.get_kdtree())
+        copied_set.append_values(np.random.random((5, 2)))
+        self.assertEqual(self.sam_set.get_kdtree().data.shape[0], 20)
+        (_, ptr) = copied_set.query(self.x)
+        nptest.assert_array_equal(
+            ptr, spatial.KDTree(copied_set.get_values()).query(self.x)[1])
+
+    def test_merge(self):
+        """
+        Check merging extends the index of the first sample set.
+        """
+        other_set = sample.sample_set(2)
+        other_set.set_values(np.random.random((10, 2)))
+        merged_set = self.sam_set.merge(other_set)
+        (_, ptr) = merged_set.query(self.x)
+        nptest.assert_array_equal(
+            ptr, spatial.KDTree(merged_set.get_values()).query(self.x)[1])
+
+
+class Test_backend_selection(unittest.TestCase):
+    """
+    Test selecting the spatial index backend globally and per sample set.
+    """
+
+    def setUp(self):
+        np.random.seed(1)
+        self.sam_set = sample.sample_set(2)
+        self.sam_set.set_values(np.random.random((20, 2)))
+        self.default = sindex.default_backend
+
+    def tearDown(self):
+        sindex.set_default_backend(self.default)
+
+    def test_unknown_backend(self):
+        """
+        Check unknown backends raise an error.
+        """
+        self.assertRaises(sindex.unknown_backend,
+                          sindex.set_default_backend, 'octree')
+        self.assertRaises(sindex.unknown_backend,
+                          self.sam_set.set_index_backend, 'octree')
+
+    def test_abstract_base(self):
+        """
+        Check the base class of the backends cannot be instantiated.
+        """
+        self.assertRaises(TypeError, sindex.index_base,
+                          self.sam_set.get_values())
+
+    def test_default_backend(self):
+        """
+        Check the global default backend is used.
+        """
+        sindex.set_default_backend('brute')
+        self.sam_set.set_kdtree()
+        self.assertIsInstance(self.sam_set.get_kdtree(), sindex.brute_index)
+        self.assertEqual(self.sam_set.get_index_backend(), 'brute')
+
+    def test_sample_set_backend(self):
+        """
+        Check the sample set backend is used, kept by copies, and gives the
+        same pointers as the default.
+        """
+        x = np.random.random((100, 2))
+        (_, ptr) = self.sam_set.query(x)
+        self.sam_set.set_index_backend('grid', workers=2)
+        self.assertIsInstance(self.sam_set.get_kdtree(), sindex.grid_index)
+        self.assertEqual(self.sam_set.get_kdtree().workers, 2)
+        (_, ptr_grid) = self.sam_set.query(x)
+        nptest.assert_array_equal(ptr, ptr_grid)
+        copied_set = self.sam_set.copy()
+        self.assertIsInstance(copied_set.get_kdtree(), sindex.grid_index)
+
+    def test_approximate(self):
+        """
+        Check approximate queries, their validation against exact search,
+        and that they are kept by copies.
+        """
+        x = np.random.random((300, 2))
+        (dist_ex, ptr_ex) = self.sam_set.query(x)
+        self.assertFalse(self.sam_set.is_approximate())
+        self.assertIsNone(self.sam_set.get_misassignment_rate())
+        fingerprint = self.sam_set.fingerprint()
+        self.sam_set.set_approximate(eps=0.5, validation_size=100)
+        self.assertTrue(self.sam_set.is_approximate())
+        self.assertNotEqual(self.sam_set.fingerprint(), fingerprint)
+        (dist, ptr) = self.sam_set.query(x)
+        self.assertTrue(np.all(dist <= 1.5 * dist_ex + 1E-12))
+        self.assertEqual(self.sam_set._validation_counts[0], 100)
+        rate = self.sam_set.get_misassignment_rate()
+        self.assertTrue(0.0 <= rate <= 1.0)
+        self.sam_set.query(x)
+        self.assertEqual(self.sam_set._validation_counts[0], 100)
+        self.assertTrue(self.sam_set.copy().is_approximate())
+
+        self.sam_set.set_approximate(0.0, validation_size=50)
+        self.sam_set.set_index_backend('rpforest')
+        self.assertTrue(self.sam_set.is_approximate())
+        (dist, ptr) = self.sam_set.query(x)
+        wrong = np.greater(dist, dist_ex * (1.0 + 1E-9))
+        self.assertEqual(self.sam_set.get_misassignment_rate(),
+                         np.mean(wrong[np.unique(np.linspace(
+                             0, 299, 50).astype(np.int64))]))
+        with self.assertRaises(ValueError):
+            self.sam_set.set_approximate(-1.0)
+
+    def test_non_finite(self):
+        """
+        Check rows with non-finite values are not indexed.
+        """
+        data = np.array([[0.0, 0.0], [np.inf, np.inf], [1.0, 1.0],
+                         [np.nan, 0.0]])
+        for backend in sindex.backends:
+            index = sindex.build_index(data, backend)
+            self.assertIsInstance(index, sindex.finite_index)
+            nptest.assert_array_equal(index.data, data)
+            (dist, ptr) = index.query(np.array([[0.9, 0.9], [0.1, 0.0]]),
+                                      k=3)
+            nptest.assert_array_equal(ptr, [[2, 0, 4], [0, 2, 4]])
+            nptest.assert_array_almost_equal(dist[:, :2],
+                                             [[np.sqrt(0.02),
+                                               np.sqrt(1.62)],
+                                              [0.1, np.sqrt(1.81)]])
+            self.assertTrue(np.all(np.isinf(dist[:, 2])))
+        index = sindex.build_index(np.array([[np.inf, np.inf]]))
+        self.assertEqual(index.query(np.zeros((2,)))[1], 1)
+
+
+class Test_box_index(unittest.TestCase):
+    """
+    Test :class:`bet.spatialIndex.box_index` against checking every
+    hyperrectangle.
+    """
+
+    def setUp(self):
+        np.random.seed(3)
+        self.dim = 2
+        self.left = np.random.random((60, self.dim)) * 0.8
+        self.right = self.left + np.random.random((60, self.dim)) * 0.2
+        self.x = np.random.random((500, self.dim))
+        self.x[0] = self.right[0]
+        self.x[1] = self.left[1]
+
+    def reference(self, k):
+        """
+        Returns the first ``k`` hyperrectangles containing each point.
+        """
+        num = self.left.shape[0]
+        dist = np.inf * np.ones((self.x.shape[0], k))
+        ptr = num * np.ones((self.x.shape[0], k), dtype=np.int64)
+        for j in range(self.x.shape[0]):
+            inside = np.nonzero(np.all(np.logical_and(
+                self.x[j] > self.left, self.x[j] <= self.right), axis=1))[0]
+            inside = inside[:k]
+            ptr[j, :len(inside)] = inside
+            dist[j, :len(inside)] = 0.0
+        return (dist, ptr)
+
+    def check(self, index):
+        """
+        Compare queries against the reference.
+        """
+        for k in [1, 3]:
+            (dist, ptr) = index.query(self.x, k=k)
+            (dist_ex, ptr_ex) = self.reference(k)
+            if k == 1:
+                dist_ex = dist_ex[:, 0]
+                ptr_ex = ptr_ex[:, 0]
+            nptest.assert_array_equal(ptr, ptr_ex)
+            nptest.assert_array_equal(dist, dist_ex)
+
+    def test_query(self):
+        """
+        Check queries using the rectangle edges as buckets.
+        """
+        self.check(sindex.box_index(self.left, self.right))
+
+    def test_query_regular_buckets(self):
+        """
+        Check queries using a regular grid of buckets.
+        """
+        index = sindex.box_index(self.left, self.right, max_buckets=50)
+        self.assertLess(len(index.edges[0]), 2 * self.left.shape[0])
+        self.check(index)
+
+    def test_query_blocks(self):
+        """
+        Check queries processed in several blocks.
+        """
+        max_block_size = sindex.max_block_size
+        sindex.max_block_size = 7
+        try:
+            self.check(sindex.box_index(self.left, self.right))
+        finally:
+            sindex.max_block_size = max_block_size
+
+
+class Test_ball_index(unittest.TestCase):
+    """
+    Test :class:`bet.spatialIndex.ball_index` against checking every ball.
+    """
+
+    def setUp(self):
+        np.random.seed(4)
+        self.dim = 2
+        self.centers = np.random.random((40, self.dim))
+        self.radii = np.random.random((40,)) * 0.2
+        self.x = np.random.random((500, self.dim))
+
+    def reference(self, k, p):
+        """
+        Returns the first ``k`` balls containing each point.
+        """
+        num = self.centers.shape[0]
+        dist = np.inf * np.ones((self.x.shape[0], k))
+        ptr = num * np.ones((self.x.shape[0], k), dtype=np.int64)
+        for j in range(self.x.shape[0]):
+            inside = np.nonzero(np.linalg.norm(self.x[j] - self.centers,
+                                               ord=p, axis=1) < self.radii)[0]
+            inside = inside[:k]
+            ptr[j, :len(inside)] = inside
+            dist[j, :len(inside)] = 0.0
+        return (dist, ptr)
+
+    def check(self, index, p):
+        """
+        Compare queries against the reference.
+        """
+        for k in [1, 3]:
+            (dist, ptr) = index.query(self.x, k=k, p=p)
+            (dist_ex, ptr_ex) = self.reference(k, p)
+            if k == 1:
+                dist_ex = dist_ex[:, 0]
+                ptr_ex = ptr_ex[:, 0]
+            nptest.assert_array_equal(ptr, ptr_ex)
+            nptest.assert_array_equal(dist, dist_ex)
+
+    def test_query(self):
+        """
+        Check queries for overlapping balls.
+        """
+        self.check(sindex.ball_index(self.centers, self.radii), 2.0)
+
+    def test_query_p_norm(self):
+        """
+        Check queries in other p-norms.
+        """
+        index = sindex.ball_index(self.centers, self.radii)
+        self.check(index, 1.0)
+        self.check(index, np.inf)
+
+    def test_query_blocks(self):
+        """
+        Check queries processed in several blocks.
+        """
+        max_block_size = sindex.max_block_size
+        sindex.max_block_size = 64 * 7
+        try:
+            self.check(sindex.ball_index(self.centers, self.radii), 2.0)
+        finally:
+            sindex.max_block_size = max_block_size
+
+    def test_empty(self):
+        """
+        Check every point is missing when there are no balls.
+        """
+        index = sindex.ball_index(np.zeros((0, self.dim)), np.zeros((0,)))
+        (dist, ptr) = index.query(self.x)
+        nptest.assert_array_equal(ptr, 0)
+        self.assertTrue(np.all(np.isinf(dist)))
@@ -0,0 +1,113 @@
+# Copyright (C) 2014-2019 The BET Development Team
+
+"""
+This module contains unittests for :mod:`~bet.storage`
+"""
+
+import unittest
+import os
+import shutil
+import tempfile
+import numpy as np
+import numpy.testing as nptest
+import bet.storage as storage
+
+
+class Test_chunked_file(unittest.TestCase):
+    """
+    Test :class:`bet.storage.chunked_file`.
+    """
+
+    def setUp(self):
+        """
+        Create a chunked file in a temporary directory.
+        """
+        self.work_dir = tempfile.mkdtemp()
+        self.file_name = os.path.join(self.work_dir, 'testfile.bet')
+        self.values = np.random.random((10, 3))
+        self.bet_file = storage.chunked_file(self.file_name, 'a')
+        self.bet_file.write('values', self.values)
+        self.bet_file.write('dim', np.array(3))
+        self.bet_file.write('type', 'bet.sample.sample_set')
+
+    def tearDown(self):
+        """
+        Remove the temporary directory.
+        """
+        shutil.rmtree(self.work_dir)
+
+    def test_is_chunked_file(self):
+        """
+        Test :meth:`bet.storage.is_chunked_file`.
+        """
+        self.assertTrue(storage.is_chunked_file(self.file_name))
+        self.assertFalse(storage.is_chunked_file(self.work_dir))
+        with self.assertRaises(storage.not_chunked_file):
+            storage.chunked_file(self.work_dir)
+
+    def test_read(self):
+        """
+        Test reading entries from a reopened file.
+        """
+        bet_file = storage.chunked_file(self.file_name)
+        self.assertEqual(sorted(bet_file.keys()), ['dim', 'type', 'values'])
+        self.assertIn('values', bet_file)
+        nptest.assert_array_equal(bet_file['values'], self.values)
+        rows = bet_file.read('values', slice(2, 5))
+        nptest.assert_array_equal(rows, self.values[2:5])
+        # only the rows are kept, not the whole chunk
+        self.assertIsNone(rows.base)
+        self.assertNotIsInstance(rows, np.memmap)
+        self.assertEqual(bet_file['dim'], 3)
+        self.assertEqual(bet_file['type'][0], 'bet.sample.sample_set')
+        self.assertEqual(bet_file.shape('values'), (10, 3))
+        with self.assertRaises(IOError):
+            bet_file.write('values', self.values)
+
+    def test_append(self):
+        """
+        Test appending rows and reading ranges of rows across chunks.
+        """
+        new_values = np.random.random((5, 3))
+        self.bet_file.append('values', new_values)
+        self.bet_file.append('values', new_values)
+        all_values = np.concatenate([self.values, new_values, new_values])
+        bet_file = storage.chunked_file(self.file_name)
+        self.assertEqual(bet_file.shape('values'), (20, 3))
+        nptest.assert_array_equal(bet_file['values'], all_values)
+        for rows in [slice(8, 17), slice(12, 14), slice(15, None),
+                     slice(0, 3), slice(30, 40)]:
+            nptest.assert_array_equal(bet_file.read('values', rows),
+                                      all_values[rows])
+        with self.assertRaises(ValueError):
+            self.bet_file.append('values', np.ones((2, 2)))
+
+    def test_replace_pop(self):
+        """
+        Test replacing and removing entries removes their chunks.
+        """
+        self.bet_file.append('values', self.values)
+        self.bet_file.write('values', np.ones((4, 2)))
+        nptest.assert_array_equal(self.bet_file['values'], np.ones((4, 2)))
+        self.assertEqual(len(os.listdir(self.file_name)), 4)
+        self.bet_file.pop('values')
+        self.assertNotIn('values', storage.chunked_file(self.file_name))
+        self.assertEqual(len(os.listdir(self.file_name)), 3)
+        self.assertIsNone(self.bet_file.pop('values'))
+
+    def test_mmap_compress(self):
+        """
+        Test memory mapped reads and compressed chunks.
+        """
+        bet_file = storage.chunked_file(self.file_name, mmap_mode='r')
+        self.assertIsInstance(bet_file['values'], np.memmap)
+        nptest.assert_array_equal(bet_file['values'], self.values)
+        bet_file = storage.chunked_file(self.file_name, 'a', compress=True)
+        bet_file.append('values', self.values)
+        bet_file.write('ones', np.ones((100, 2)))
+        self.assertTrue(os.path.exists(os.path.join(self.file_name,
+                                                    'ones.0.npz')))
+        bet_file = storage.chunked_file(self.file_name, mmap_mode='r')
+        nptest.assert_array_equal(bet_file['ones'], np.ones((100, 2)))
+        nptest.assert_array_equal(bet_file['values'],
+                                  np.concatenate([self.values, self.values]))
@@ -5,7 +5,7 @@ This module contains unittests for :mod:`~bet.util`
 """
 
 import bet.util as util
-from bet.Comm import comm
+from bet.Comm import comm, MPI
 import numpy.testing as nptest
 import numpy as np
 
@@ -88,6 +88,100 @@ def compare_get_global_values(i, provide_shape):
     nptest.assert_array_equal(original_array, recomposed_array)
 
 
+def test_cell_sums():
+    """
+    Tests :meth:`bet.util.cell_sums` against summing over each cell.
+    """
+    for (num, size) in [(5, 3), (37, 10), (37, 10000), (200, 1000),
+                        (2000, 50000)]:
+        yield compare_cell_sums, num, size
+
+
+def compare_cell_sums(num, size):
+    """
+    Compares the counts and sums of :meth:`bet.util.cell_sums` bit for bit
+    against ``np.sum`` over each cell for ``size`` pointers into ``num``
+    cells, including pointers outside of the cells.
+
+    :param int num: number of cells
+    :param int size: number of pointers
+
+    """
+    np.random.seed(num + size)
+    ptr = np.random.randint(0, num + 1, size)
+    weights = [np.random.random((size,)) *
+               np.random.choice([1E-8, 1.0, 1E8], size),
+               np.random.random((size,))]
+    (counts, sums) = util.cell_sums(ptr, num, weights, globalize=False)
+    assert counts.shape == (num,)
+    assert len(sums) == 2
+    for i in range(num):
+        Itemp = np.equal(ptr, i)
+        assert counts[i] == np.sum(Itemp)
+        for w, w_sum in zip(weights, sums):
+            assert w_sum[i] == np.sum(w[Itemp])
+    (counts_global, sums_global) = util.cell_sums(ptr, num, weights)
+    nptest.assert_array_equal(counts_global, comm.size * counts)
+    (counts_only, no_sums) = util.cell_sums(ptr, num)
+    nptest.assert_array_equal(counts_only, comm.size * counts)
+    assert no_sums == []
+
+
+def test_cell_sums_float32():
+    """
+    Tests that :meth:`bet.util.cell_sums` sums single precision weights in
+    double precision.
+    """
+    np.random.seed(3)
+    ptr = np.random.randint(0, 10, 1000)
+    weights = np.random.random((1000,)).astype(np.float32)
+    (_, [sums]) = util.cell_sums(ptr, 10, [weights], globalize=False)
+    (_, [sums64]) = util.cell_sums(ptr, 10, [weights.astype(np.float64)],
+                                   globalize=False)
+    assert sums.dtype == np.float64
+    nptest.assert_array_equal(sums, sums64)
+
+
+def test_index_dtype():
+    """
+    Tests :meth:`bet.util.index_dtype`.
+    """
+    assert util.index_dtype(100) == np.int32
+    assert util.index_dtype(2**40) == np.int64
+
+
+def test_get_mpi_type():
+    """
+    Tests :meth:`bet.util.get_mpi_type` for the types of
+    :meth:`bet.util.get_global_values`.
+    """
+    assert util.get_mpi_type(np.dtype(np.float64)) == MPI.DOUBLE
+    for dtype in [np.float32, np.int32]:
+        values = np.arange(comm.size * 3, dtype=dtype).reshape(-1, 3)
+        global_values = util.get_global_values(values[comm.rank:comm.rank + 1],
+                                               values.shape)
+        assert global_values.dtype == dtype
+        nptest.assert_array_equal(global_values, values)
+
+
+def test_cell_maxima():
+    """
+    Tests :meth:`bet.util.cell_maxima` against the maximum over each cell.
+    """
+    np.random.seed(2)
+    num = 40
+    ptr = np.random.randint(0, num + 1, 30)
+    values = np.random.random((30,))
+    maxima = util.cell_maxima(ptr, num, values)
+    assert maxima.shape == (num,)
+    for i in range(num):
+        Itemp = np.equal(ptr, i)
+        if np.any(Itemp):
+            assert maxima[i] == np.max(values[Itemp])
+        else:
+            assert maxima[i] == 0.0
+
+
 def test_fix_dimensions_vector():
     """
     Tests :meth:`bet.util.fix_dimensions_vector`